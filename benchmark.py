@@ -0,0 +1,161 @@
+import sys
+import json
+import time
+import pathlib
+import argparse
+import platform
+import datetime
+import resource
+import tempfile
+import concurrent.futures
+import numpy as np
+from pso_solver import *
+
+
+# Suite di benchmark sulle istanze di Problems/: ogni istanza gira in un processo nuovo così tempi di caricamento
+# e picco di memoria non dipendono dalle istanze precedenti. Le metriche sono salvate in un JSON di riferimento
+# e compare segnala le regressioni oltre la tolleranza
+# Ogni passo cronometrato è ripetuto repeats volte e viene salvato il tempo minimo, il meno disturbato dal rumore
+BENCHMARK_SETTINGS = {'iterations': 500, 'num_particles': 20, 'seeds': [0, 1, 2], 'repeats': 5}
+
+# Metriche controllate da compare: per ognuna True se un valore più alto è migliore e la variazione assoluta minima
+# da considerare, così il rumore su tempi di frazioni di millisecondo non diventa una regressione relativa del 50%.
+# evaluations_per_second è solo l'inverso di time_per_iteration, viene salvata ma non controllata
+METRICS = {'parse_time': (False, 0.002),
+           'load_time': (False, 0.002),
+           'time_per_iteration': (False, 0.00002),
+           'peak_rss_mb': (False, 5),
+           'mean_error': (False, 0)}
+
+
+def peak_rss_mb():
+    # ru_maxrss è in kilobyte su Linux e in byte su macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def best_time(function, repeats):
+    # Tempo minimo su repeats esecuzioni e risultato dell'ultima
+    times = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start_time)
+    return min(times), result
+
+def benchmark_instance(problem_path, settings):
+    problem_path = str(problem_path)
+    repeats = settings.get('repeats', 1)
+    parse_time, (cities, _) = best_time(lambda: read_tsp_instance(problem_path), repeats)
+
+    # Caricamento dalla cache: la prima chiamata su una cache vuota compila, le successive misurano il caso normale
+    with tempfile.TemporaryDirectory() as cache_dir:
+        load_instance(problem_path, cache_dir)
+        load_time, _ = best_time(lambda: load_instance(problem_path, cache_dir), repeats)
+
+    # A parità di seed il lavoro è identico, per ogni seed tengo il tempo dell'esecuzione più veloce
+    params = {'num_particles': settings['num_particles'], 'max_iterations': settings['iterations']}
+    elapsed_times, errors = [], []
+    for seed in settings['seeds']:
+        results = [solve(problem_path, params, seed=seed) for _ in range(repeats)]
+        elapsed_times.append(min(result['elapsed_time'] for result in results))
+        errors.append(results[0]['error'])
+    elapsed_time = sum(elapsed_times)
+    iterations = settings['iterations'] * len(settings['seeds'])
+
+    return {'num_cities': len(cities),
+            'parse_time': parse_time,
+            'load_time': load_time,
+            'time_per_iteration': elapsed_time / iterations,
+            'evaluations_per_second': settings['num_particles'] * iterations / elapsed_time,
+            'peak_rss_mb': peak_rss_mb(),
+            'mean_error': float(np.mean(errors)) if None not in errors else None,
+            'errors': errors}
+
+def run_benchmark(problems_paths, settings=BENCHMARK_SETTINGS):
+    instances = {}
+    for problem_path in problems_paths:
+        # Un processo nuovo per ogni istanza: ogni istanza ha il proprio pool
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1) as executor:
+            metrics = executor.submit(benchmark_instance, problem_path, settings).result()
+        name = pathlib.Path(problem_path).stem
+        instances[name] = metrics
+        print(f"{name}: {metrics['time_per_iteration'] * 1000:.3f} ms/iteration, {metrics['evaluations_per_second']:.0f} evaluations/s, "
+              f"load {metrics['load_time'] * 1000:.2f} ms (parse {metrics['parse_time'] * 1000:.1f} ms), "
+              f"peak RSS {metrics['peak_rss_mb']:.1f} MB, mean error {metrics['mean_error']}", file=sys.stderr)
+    return {'created': datetime.datetime.now().isoformat(timespec="seconds"),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'settings': settings,
+            'instances': instances}
+
+def compare_benchmarks(baseline, current, tolerance=0.1):
+    # Restituisce le regressioni: metriche peggiorate di più della tolleranza relativa rispetto al riferimento
+    regressions = []
+    for name, baseline_metrics in baseline['instances'].items():
+        if name not in current['instances']:
+            continue
+        current_metrics = current['instances'][name]
+        for metric, (higher_is_better, min_change) in METRICS.items():
+            reference, value = baseline_metrics.get(metric), current_metrics.get(metric)
+            if reference is None or value is None or abs(value - reference) <= min_change:
+                continue
+            change = (value - reference) / abs(reference) if reference else (value - reference)
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append({'instance': name, 'metric': metric, 'baseline': reference, 'current': value, 'change': change})
+    return regressions
+
+def default_problems():
+    # Dalla più piccola alla più grande
+    return sorted(pathlib.Path('Problems').glob('*.tsp'), key=lambda problem_path: len(load_instance(str(problem_path))[0]))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmark", description="Benchmark suite over Problems/ with regression baselines")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="run the benchmark and save the results")
+    run_parser.add_argument("--output", default="benchmark_baseline.json")
+    compare_parser = commands.add_parser("compare", help="compare against a baseline, exit with status 1 on regressions")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current", nargs="?", default=None, help="results to compare (default: run the benchmark now)")
+    compare_parser.add_argument("--tolerance", type=float, default=0.1, help="allowed relative worsening (default 0.1 = 10%%)")
+    for command_parser in (run_parser, compare_parser):
+        command_parser.add_argument("--problems", nargs="+", default=None, help=".tsp files (default: every .tsp in Problems/)")
+    # compare riusa sempre le impostazioni del riferimento, queste opzioni valgono solo per run
+    run_parser.add_argument("--iterations", type=int, default=BENCHMARK_SETTINGS['iterations'])
+    run_parser.add_argument("--num-particles", type=int, default=BENCHMARK_SETTINGS['num_particles'])
+    run_parser.add_argument("--seeds", type=int, nargs="+", default=BENCHMARK_SETTINGS['seeds'])
+    run_parser.add_argument("--repeats", type=int, default=BENCHMARK_SETTINGS['repeats'], help="repetitions of each timed step, the minimum is kept")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.command == "run":
+        settings = {'iterations': args.iterations, 'num_particles': args.num_particles, 'seeds': args.seeds, 'repeats': args.repeats}
+        results = run_benchmark(args.problems or default_problems(), settings)
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+        return
+
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    if args.current is None:
+        # Uso le stesse impostazioni del riferimento, altrimenti tempi ed errori non sono confrontabili
+        current = run_benchmark(args.problems or [path for path in default_problems() if path.stem in baseline['instances']], baseline['settings'])
+    else:
+        with open(args.current) as current_file:
+            current = json.load(current_file)
+    if current['settings'] != baseline['settings']:
+        print(f"Warning: settings differ from the baseline ({current['settings']} vs {baseline['settings']})", file=sys.stderr)
+
+    if not set(baseline['instances']) & set(current['instances']):
+        sys.exit("No instance in common with the baseline")
+    regressions = compare_benchmarks(baseline, current, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression['instance']} {regression['metric']}: {regression['baseline']:.6g} -> {regression['current']:.6g} ({regression['change']:+.1%})")
+    if regressions:
+        sys.exit(1)
+    print(f"No regressions beyond {args.tolerance:.0%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import json
+import numpy as np
+from tsp_instance import save_atomic
+from instrumentation import new_profiler
+
+
+# Checkpoint dello stato completo di un'esecuzione in un .npz: le matrici dello sciame in binario e gli scalari
+# (parametri, iterazione, w corrente, seed e stato del generatore numpy...) in un JSON. Un'esecuzione ripresa da un
+# checkpoint prosegue esattamente come quella originale. Il profiler non viene salvato, riparte vuoto;
+# le liste dei vicini della ricerca locale sono ricalcolate alla ripresa
+SWARM_ARRAYS = ('position', 'velocity', 'fitness', 'best_position', 'best_fitness', 'tour')
+
+
+def save_checkpoint(state, path):
+    swarm, global_best_particle = state['swarm'], state['global_best_particle']
+    arrays = {name: swarm[name] for name in SWARM_ARRAYS if swarm[name] is not None}
+    if global_best_particle['position'] is not None:
+        arrays['global_best_position'] = global_best_particle['position']
+    meta = {'instance': state['instance'],
+            'params': state['params'],
+            'seed': state['seed'],
+            'spawn_key': state['spawn_key'],
+            'iteration': state['iteration'],
+            'w': state['w'],
+            'last_update_iteration': state['last_update_iteration'],
+            'elapsed_time': state['elapsed_time'],
+            'stop_reason': state['stop_reason'],
+            'global_best_fitness': global_best_particle['fitness'],
+            'evaluations': swarm['evaluations'],
+            'rng_state': state['rng'].bit_generator.state}
+    arrays['meta'] = np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8)
+    save_atomic(path, lambda checkpoint_file, data: np.savez_compressed(checkpoint_file, **data), arrays)
+
+def load_checkpoint(path):
+    with np.load(path) as checkpoint:
+        meta = json.loads(checkpoint['meta'].tobytes().decode())
+        swarm = {name: checkpoint[name].copy() if name in checkpoint else None for name in SWARM_ARRAYS}
+        global_best_position = checkpoint['global_best_position'].copy() if 'global_best_position' in checkpoint else None
+    swarm['evaluations'] = meta['evaluations']
+    rng = np.random.default_rng()
+    rng.bit_generator.state = meta['rng_state']
+    return {'instance': meta['instance'],
+            'params': meta['params'],
+            'seed': meta['seed'],
+            'spawn_key': meta['spawn_key'],
+            'swarm': swarm,
+            'global_best_particle': {'position': global_best_position, 'fitness': meta['global_best_fitness']},
+            'iteration': meta['iteration'],
+            'w': meta['w'],
+            'last_update_iteration': meta['last_update_iteration'],
+            'elapsed_time': meta['elapsed_time'],
+            'stop_reason': meta['stop_reason'],
+            'profiler': new_profiler() if meta['params']['profile'] else None,
+            'rng': rng,
+            'neighbors': None}
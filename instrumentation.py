@@ -0,0 +1,66 @@
+import json
+import time
+
+
+# Strumentazione leggera del ciclo PSO: tempi cumulativi per fase, contatori e andamento del best globale.
+# Il solver la usa solo se il profiler esiste, quando è spento il costo è un confronto con None per fase
+
+def new_profiler(max_events=100000):
+    # events raccoglie gli intervalli (fase, inizio, fine) per il Chrome trace, fino a max_events
+    return {'origin': time.perf_counter(),
+            'phases': {},
+            'counters': {},
+            'best_trace': [],
+            'events': [],
+            'max_events': max_events}
+
+def record_phase(profiler, phase, start):
+    # Chiude la fase iniziata a start e restituisce l'istante corrente, da usare come inizio della fase successiva
+    end = time.perf_counter()
+    total, calls = profiler['phases'].get(phase, (0.0, 0))
+    profiler['phases'][phase] = (total + end - start, calls + 1)
+    if len(profiler['events']) < profiler['max_events']:
+        profiler['events'].append((phase, start, end))
+    return end
+
+def count(profiler, counter, amount=1):
+    profiler['counters'][counter] = profiler['counters'].get(counter, 0) + amount
+
+def record_best(profiler, iteration, fitness):
+    profiler['best_trace'].append((iteration, time.perf_counter() - profiler['origin'], fitness))
+
+def profile_summary(profiler):
+    # Riepilogo strutturato (serializzabile in JSON) da allegare al risultato
+    return {'phases': {phase: {'total_time': total, 'calls': calls, 'mean_time': total / calls}
+                       for phase, (total, calls) in profiler['phases'].items()},
+            'counters': dict(profiler['counters']),
+            'best_trace': [list(point) for point in profiler['best_trace']],
+            'truncated_events': len(profiler['events']) >= profiler['max_events']}
+
+def chrome_trace(profiler, pid=0):
+    # Formato Trace Event di Chrome (chrome://tracing, Perfetto): una "X" per fase e un contatore per il best globale
+    origin = profiler['origin']
+    events = [{'name': phase, 'ph': 'X', 'pid': pid, 'tid': 0, 'ts': (start - origin) * 1e6, 'dur': (end - start) * 1e6}
+              for phase, start, end in profiler['events']]
+    events += [{'name': 'best_fitness', 'ph': 'C', 'pid': pid, 'tid': 0, 'ts': elapsed * 1e6, 'args': {'fitness': fitness}}
+               for _, elapsed, fitness in profiler['best_trace']]
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+def write_profile(profiler, path, trace_format='json'):
+    data = chrome_trace(profiler) if trace_format == 'chrome' else profile_summary(profiler)
+    with open(path, "w") as profile_file:
+        json.dump(data, profile_file)
+
+def write_profiles(profilers, path, trace_format='json', label='island'):
+    # Profili di più sciami in un solo file: nel Chrome trace ogni sciame è un processo (tempi dal suo avvio),
+    # nel JSON c'è un riepilogo per sciame
+    if trace_format == 'chrome':
+        events = []
+        for pid, profiler in enumerate(profilers):
+            events.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': f"{label} {pid}"}})
+            events += chrome_trace(profiler, pid)['traceEvents']
+        data = {'traceEvents': events, 'displayTimeUnit': 'ms'}
+    else:
+        data = {f"{label}s": [profile_summary(profiler) for profiler in profilers]}
+    with open(path, "w") as profile_file:
+        json.dump(data, profile_file)
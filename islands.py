@@ -0,0 +1,179 @@
+import sys
+import time
+import queue
+import traceback
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+from pso_solver import *
+from instrumentation import write_profiles
+
+
+# Modello a isole: num_islands sotto-sciami in processi separati che ogni migration_interval iterazioni pubblicano
+# il proprio best globale in una lavagna in memoria condivisa (riga = [fitness, chiavi...]) e ricevono il migliore
+# tra quelli delle isole collegate dalla topologia, senza passare dal pickle
+TOPOLOGIES = ('ring', 'full')
+# Secondi tra due controlli dei processi delle isole mentre il processo principale aspetta i risultati
+RESULT_POLL_INTERVAL = 1.0
+
+
+def migration_sources(island, num_islands, topology):
+    # Isole da cui island riceve i migranti
+    if num_islands == 1:
+        return []
+    if topology == 'ring':
+        return [(island - 1) % num_islands]
+    return [other for other in range(num_islands) if other != island]
+
+def migrate(state, board, sources):
+    # Il migliore tra i migranti prende il posto della particella peggiore dell'isola, se è migliore di lei
+    if not sources:
+        return
+    source = min(sources, key=lambda other: board[other, 0])
+    fitness, keys = board[source, 0].item(), board[source, 1:].copy()
+    swarm, global_best_particle = state['swarm'], state['global_best_particle']
+    worst = int(np.argmax(swarm['fitness']))
+    if fitness >= swarm['fitness'][worst]:
+        return
+    swarm['position'][worst] = keys
+    if fitness < swarm['best_fitness'][worst]:
+        swarm['best_fitness'][worst] = fitness
+        swarm['best_position'][worst] = keys
+    if fitness < global_best_particle['fitness']:
+        global_best_particle['fitness'] = fitness
+        global_best_particle['position'] = keys.copy()
+        state['last_update_iteration'] = state['iteration']
+
+def island_worker(island, instance, params, seed, num_islands, migration_interval, topology, shared_name, barrier, results):
+    # Anche l'aggancio alla memoria condivisa sta nel try: se fallisce la barriera viene rotta e il processo principale
+    # riceve l'errore, invece di restare bloccato insieme alle altre isole
+    shared, board = None, None
+    try:
+        shared = shared_memory.SharedMemory(name=shared_name)
+        board = np.ndarray((num_islands, len(load_instance(instance)[0]) + 1), dtype=float, buffer=shared.buf)
+        state = start_run(instance, params, seed)
+        trace = []
+        sources = migration_sources(island, num_islands, topology)
+        # Tutte le isole fanno lo stesso numero di epoche, anche quelle già fermate da un criterio di arresto,
+        # altrimenti le altre resterebbero bloccate sulla barriera
+        for stop_iteration in range(migration_interval, params['max_iterations'] + migration_interval, migration_interval):
+            run_iterations(state, stop_iteration)
+            global_best_particle = state['global_best_particle']
+            board[island, 0] = global_best_particle['fitness']
+            board[island, 1:] = global_best_particle['position']
+            trace.append([min(stop_iteration, params['max_iterations']), global_best_particle['fitness']])
+            barrier.wait()
+            migrate(state, board, sources)
+            # Seconda barriera: nessuna isola riscrive la lavagna mentre un'altra la sta ancora leggendo
+            barrier.wait()
+        result = run_result(state)
+        result['island'] = island
+        result['convergence'] = trace
+        # Il profilo completo (con gli intervalli per il Chrome trace) torna al processo principale, che lo scrive su file
+        result['profiler'] = state['profiler']
+        results.put((island, result, None))
+    except Exception:
+        barrier.abort()
+        results.put((island, None, traceback.format_exc()))
+    finally:
+        del board
+        if shared is not None:
+            shared.close()
+
+def solve_islands(instance, params=None, num_islands=4, migration_interval=50, topology='ring', seed=None, profile_path=None, profile_format='json'):
+    # Con params['profile'] e profile_path i profili delle isole sono scritti in un solo file (vedi write_profiles)
+    params = {**DEFAULT_PARAMS, **(params or {})}
+    if topology not in TOPOLOGIES:
+        raise ValueError(f"topology must be one of {TOPOLOGIES}")
+    start_time = time.perf_counter()
+    # Caricare l'istanza qui prepara anche la cache su disco per i processi delle isole
+    num_cities = len(load_instance(instance)[0])
+    seed_sequence = np.random.SeedSequence(seed)
+    # Ogni isola ha un flusso indipendente derivato con spawn, registrato nel suo risultato con seed e spawn_key
+    island_seeds = seed_sequence.spawn(num_islands)
+
+    shared = shared_memory.SharedMemory(create=True, size=num_islands * (num_cities + 1) * np.dtype(float).itemsize)
+    try:
+        board = np.ndarray((num_islands, num_cities + 1), dtype=float, buffer=shared.buf)
+        board[:] = np.inf
+        del board
+        context = multiprocessing.get_context()
+        barrier = context.Barrier(num_islands)
+        results = context.Queue()
+        processes = [context.Process(target=island_worker, args=(island, str(instance), params, island_seeds[island], num_islands,
+                                                                 migration_interval, topology, shared.name, barrier, results))
+                     for island in range(num_islands)]
+        for process in processes:
+            process.start()
+        island_results, errors = [None] * num_islands, []
+        pending = set(range(num_islands))
+        while pending:
+            try:
+                island, result, error = results.get(timeout=RESULT_POLL_INTERVAL)
+            except queue.Empty:
+                # Un'isola che termina normalmente esce con codice 0 dopo aver messo il risultato in coda; se è stata
+                # uccisa dall'esterno rompo la barriera, così le altre si fermano e mandano il loro errore
+                for island in sorted(pending):
+                    exitcode = processes[island].exitcode
+                    if exitcode is not None and exitcode != 0:
+                        pending.discard(island)
+                        errors.append(f"Island {island}: the process exited with code {exitcode}")
+                        barrier.abort()
+                continue
+            pending.discard(island)
+            island_results[island] = result
+            if error is not None:
+                errors.append(f"Island {island}:\n{error}")
+        for process in processes:
+            process.join()
+    finally:
+        shared.close()
+        shared.unlink()
+    if errors:
+        raise RuntimeError("\n".join(errors))
+    profilers = [result.pop('profiler') for result in island_results]
+    if profile_path is not None and params['profile']:
+        write_profiles(profilers, profile_path, profile_format)
+
+    best = min(island_results, key=lambda result: result['best_fitness'])
+    convergence = [[iteration, min(result['convergence'][epoch][1] for result in island_results)]
+                   for epoch, (iteration, _) in enumerate(best['convergence'])]
+    return {'instance': str(instance),
+            'params': params,
+            'seed': seed_sequence.entropy,
+            'num_islands': num_islands,
+            'migration_interval': migration_interval,
+            'topology': topology,
+            'best_solution': best['best_solution'],
+            'best_fitness': best['best_fitness'],
+            'best_island': best['island'],
+            'optimal_solution': best['optimal_solution'],
+            'optimal_cost': best['optimal_cost'],
+            'error': best['error'],
+            'convergence': convergence,
+            'islands': [{name: value for name, value in result.items() if name not in ('best_solution', 'optimal_solution', 'params', 'instance')}
+                        for result in island_results],
+            'elapsed_time': time.perf_counter() - start_time}
+
+def main(argv=None):
+    parser = build_parser("python -m islands", "Island-model PSO TSP solver: sub-swarms in separate processes with periodic migration")
+    parser.add_argument("--islands", type=int, default=4, help="number of sub-swarms (one process each)")
+    parser.add_argument("--migration-interval", type=int, default=50, help="iterations between two migrations")
+    parser.add_argument("--topology", choices=TOPOLOGIES, default='ring')
+    args = parser.parse_args(argv)
+    # Il checkpoint salva un solo sciame: riprendere le isole richiederebbe tutti gli sciami e la lavagna alla stessa epoca
+    if args.checkpoint is not None or args.checkpoint_every is not None or args.checkpoint_seconds is not None:
+        parser.error("checkpoints are not supported by the island model")
+    params = params_from_args(args)
+    if args.islands <= 0 or args.migration_interval <= 0:
+        sys.exit("islands and migration-interval must be greater than 0")
+
+    result = solve_islands(args.tsp_file, params, args.islands, args.migration_interval, args.topology, args.seed, args.profile, args.profile_format)
+    if not args.quiet:
+        for island in result['islands']:
+            print(f"Island {island['island']}: best fitness {island['best_fitness']} stop reason {island['stop_reason']}", file=sys.stderr)
+        print(f"Global best fitness {result['best_fitness']} from island {result['best_island']}", file=sys.stderr)
+    write_result(result, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import collections
+import numpy as np
+from tsp_instance import is_coordinate_backed, candidate_graph, edge_costs, edge_cost_function
+
+
+# Ricerca locale (2-opt e Or-opt) per la fase memetica del PSO. Le mosse considerate collegano ogni città solo
+# alle sue vicine più prossime e i don't-look bits sono gestiti con una coda di città attive, così il costo
+# di una passata cresce con n * k invece che con n²
+
+def nearest_neighbors(distances, k, chunk_size=1024):
+    # Liste delle k città più vicine a ogni città (ordinate per distanza), calcolate a blocchi di righe.
+    # Le istanze con coordinate hanno già il grafo dei candidati, lo ricalcolo solo se servono più vicini
+    if is_coordinate_backed(distances):
+        if k <= distances['neighbors'].shape[1]:
+            return np.array(distances['neighbors'][:, :k])
+        return candidate_graph(distances['coords'], distances['edge_weight_type'], k)
+    num_cities = len(distances)
+    k = min(k, num_cities - 1)
+    neighbors = np.empty((num_cities, k), dtype=np.int64)
+    for start in range(0, num_cities, chunk_size):
+        block = np.array(distances[start:start + chunk_size], dtype=float)
+        rows = np.arange(len(block))
+        block[rows, rows + start] = np.inf
+        candidates = np.argpartition(block, k - 1, axis=1)[:, :k]
+        order = np.argsort(np.take_along_axis(block, candidates, axis=1), axis=1, kind='stable')
+        neighbors[start:start + len(block)] = np.take_along_axis(candidates, order, axis=1)
+    return neighbors
+
+def reverse_segment(tour, position, start, end):
+    # Inverte il tratto ciclico tour[start..end]; se è più lungo di metà tour inverto il complementare, il ciclo è lo stesso
+    num_cities = len(tour)
+    length = (end - start) % num_cities + 1
+    if 2 * length > num_cities:
+        start, end = (end + 1) % num_cities, (start - 1) % num_cities
+        length = num_cities - length
+    for _ in range(length // 2):
+        tour[start], tour[end] = tour[end], tour[start]
+        position[tour[start]] = start
+        position[tour[end]] = end
+        start = (start + 1) % num_cities
+        end = (end - 1) % num_cities
+
+def exchange_edges(tour, position, t1, t2, t3, t4):
+    # Mossa 2-opt sul ciclo: gli archi (t1, t2) e (t3, t4), percorsi nello stesso verso, diventano (t1, t3) e (t2, t4).
+    # reverse_segment può invertire il complementare, quindi il verso di percorrenza nell'array va ricontrollato ogni volta
+    num_cities = len(tour)
+    if tour[(position[t1] + 1) % num_cities] == t2:
+        reverse_segment(tour, position, position[t2], position[t3])
+    else:
+        reverse_segment(tour, position, position[t3], position[t2])
+
+def two_opt_move(city, tour, position, distance, neighbors, neighbor_distances):
+    # Cerca la prima mossa 2-opt migliorativa che porta city accanto a una delle sue vicine
+    num_cities = len(tour)
+    i = position[city]
+    for step in (1, -1):
+        other = tour[(i + step) % num_cities]
+        current = distance(city, other)
+        for candidate, candidate_distance in zip(neighbors[city], neighbor_distances[city]):
+            if candidate_distance >= current:
+                break
+            j = position[candidate]
+            candidate_other = tour[(j + step) % num_cities]
+            if candidate == other or candidate_other == city:
+                continue
+            delta = candidate_distance + distance(other, candidate_other) - current - distance(candidate, candidate_other)
+            if delta < -1e-9:
+                if step == 1:
+                    reverse_segment(tour, position, (i + 1) % num_cities, j)
+                else:
+                    reverse_segment(tour, position, j, (i - 1) % num_cities)
+                return delta, (city, other, candidate, candidate_other)
+    return 0.0, ()
+
+def or_opt_move(city, tour, position, distance, neighbors, neighbor_distances, max_segment=3):
+    # Sposta il tratto di 1..max_segment città che inizia da city accanto a una vicina di city
+    num_cities = len(tour)
+    if num_cities < max_segment + 3:
+        return 0.0, ()
+    i = position[city]
+    before = tour[(i - 1) % num_cities]
+    for length in range(1, max_segment + 1):
+        last = tour[(i + length - 1) % num_cities]
+        after = tour[(i + length) % num_cities]
+        removal_gain = distance(before, city) + distance(last, after) - distance(before, after)
+        segment = {tour[(i + offset) % num_cities] for offset in range(length)}
+        for candidate, candidate_distance in zip(neighbors[city], neighbor_distances[city]):
+            if candidate_distance >= removal_gain:
+                break
+            if candidate in segment:
+                continue
+            j = position[candidate]
+            # candidate, city..last, successivo oppure precedente, last..city, candidate
+            for neighbor_step, reverse in ((1, False), (-1, True)):
+                other = tour[(j + neighbor_step) % num_cities]
+                if other in segment:
+                    continue
+                delta = candidate_distance + distance(last, other) - distance(candidate, other) - removal_gain
+                if delta < -1e-9:
+                    # Inserimento come sequenza di mosse 2-opt: due per il tratto invertito, una terza lo raddrizza
+                    a, b = (other, candidate) if reverse else (candidate, other)
+                    exchange_edges(tour, position, before, city, a, b)
+                    exchange_edges(tour, position, before, a, after, last)
+                    if not reverse:
+                        exchange_edges(tour, position, a, last, city, b)
+                    return delta, (city, last, before, after, candidate, other)
+    return 0.0, ()
+
+def improve_tour(tour, distances, neighbors, or_opt=True):
+    # Porta il tour in un ottimo locale rispetto a 2-opt (e Or-opt), restituisce il nuovo tour e la variazione di costo
+    tour = [int(city) for city in tour]
+    position = [0] * len(tour)
+    for k, city in enumerate(tour):
+        position[city] = k
+    distance = edge_cost_function(distances)
+    neighbor_distances = np.asarray(edge_costs(distances, np.arange(len(tour))[:, None], neighbors)).tolist()
+    neighbor_lists = neighbors.tolist()
+
+    # Coda delle città attive: una città esce dalla coda (don't-look bit acceso) quando nessuna mossa la migliora
+    active = collections.deque(tour)
+    queued = [True] * len(tour)
+    total_delta = 0.0
+    while active:
+        city = active.popleft()
+        queued[city] = False
+        delta, touched = two_opt_move(city, tour, position, distance, neighbor_lists, neighbor_distances)
+        if not touched and or_opt:
+            delta, touched = or_opt_move(city, tour, position, distance, neighbor_lists, neighbor_distances)
+        if touched:
+            total_delta += delta
+            for other in (city,) + touched:
+                if not queued[other]:
+                    queued[other] = True
+                    active.append(other)
+    return np.array(tour), total_delta
+
+def keys_for_tour(random_key, tour):
+    # Riassegno le chiavi della particella in modo che la decodifica dia esattamente il tour migliorato
+    keys = np.empty_like(random_key)
+    keys[tour] = np.sort(random_key)
+    return keys
@@ -1,103 +1,95 @@
-import random
-import tsplib95
+import queue
+import traceback
+import multiprocessing
 import customtkinter as ctk
 from tkinter import filedialog
-from sklearn.preprocessing import minmax_scale
-
-
-def get_optimal_path(file_path):
-    solution_file_path = file_path[:-3] + "opt.tour"
-    solution = tsplib95.load(solution_file_path).tours[0]
-    if tsplib95.load(file_path).edge_weight_format == "LOWER_DIAG_ROW":
-        solution = [x - 1 for x in solution]
-    return solution
-
-def read_tsp_instance(file_path):
-    problem = tsplib95.load(file_path)
-    cities = list(problem.get_nodes())
-    distances = {(i, j): problem.get_weight(i, j) for i in cities for j in cities if i != j}
-    return cities, distances
-
-def initialize_particles(num_particles, num_cities):
-    particles = [{'position': [random.random() for _ in range(num_cities)],
-                  'velocity': [random.random() for _ in range(num_cities)],
-                  'fitness': float('inf'), 
-                  'best_position': None,
-                  'best_fitness': float('inf')} for _ in range(num_particles)]
-    return particles
-
-def random_key_to_tsp_solution(random_key, cities):
-    sorted_cities = [city for _, city in sorted(zip(random_key, cities))]
-    return sorted_cities
-
-def tsp_fitness(solution, distances):
-    total_distance = sum(distances[solution[i - 1], solution[i]] for i in range(len(solution)))
-    # Aggiungo l'arco dall'ultima alla prima città quando i = 0
-    return total_distance
-
-def update_particles(particles, best_particle, w, c1, c2):
-    for particle in particles:
-        for i in range(len(particle['position'])):
-            r1, r2 = random.random(), random.random()
-            particle['velocity'][i] = w * particle['velocity'][i] + c1 * r1 * (best_particle['position'][i] - particle['position'][i]) + c2 * r2 * (particle['best_position'][i] - particle['position'][i])
-            particle['position'][i] += particle['velocity'][i]
-
-        particle['position'] = minmax_scale(particle['position'], feature_range=(0,1))
-
-def pso_tsp(file_path, num_particles, max_iterations, w, c1, c2, variable_w, result_label=None, window=None, progress_bar=None):
-    progress_bar.set(0)
-    window.update()
-    print(f"Now running with: w = {w}, c1 = {c1}, c2 = {c2}, num_particles = {num_particles}, max_iterations = {max_iterations}, variable w {variable_w}")
-    if variable_w:
-        diminishing_rate = ((w) / max_iterations)
-    cities, distances = read_tsp_instance(file_path)
-    num_cities = len(cities)
-
-    particles = initialize_particles(num_particles, num_cities)
-    global_best_particle = {'position': None, 'fitness': float('inf')}
-    last_update_iteration = 0
-    
-    for iteration in range(max_iterations):
-        if iteration == max_iterations-1:
-            progress_bar.set(100)
-            window.update()
-        elif iteration % (max_iterations / 100) == 0 and iteration != 0:
-            progress_bar.step()
-            window.update()
-        
-        for particle in particles:
-            tsp_solution = random_key_to_tsp_solution(particle['position'], cities)
-            particle['fitness'] = tsp_fitness(tsp_solution, distances)
-
-            # Aggiorno la miglior posizione della particella
-            if particle['fitness'] < particle['best_fitness']:
-                particle['best_fitness'] = particle['fitness']
-                particle['best_position'] = particle['position']
-
-            # Aggiorno la miglior posizione globale
-            if particle['fitness'] < global_best_particle['fitness']:
-                last_update_iteration = iteration
-                print(f"Updated best solution at iteration: {iteration} with fitness of {particle['fitness']}")
-                result_label.configure(text=f"Running...\nUpdated best solution at iteration: {iteration} with fitness of {particle['fitness']}")
-                window.update()
-                global_best_particle['fitness'] = particle['fitness']
-                global_best_particle['position'] = particle['position']
-
-        # Calcolo il valore attuale di w (diminuendo linearmente da initial_w a 0)
-        if variable_w:
-            w = w - diminishing_rate
-        
-        # Aggiorno le posizioni delle particelle
-        update_particles(particles, global_best_particle, w, c1, c2)
+from pso_solver import *
 
-    # La migliore soluzione è rappresentata dalla miglior particella
-    best_solution = random_key_to_tsp_solution(global_best_particle['position'], cities)
-    best_fitness = global_best_particle['fitness']
-    optimal_solution = get_optimal_path(file_path)
-    optimal_cost = tsp_fitness(optimal_solution, distances)
-    error = ((best_fitness - optimal_cost) / optimal_cost) * 100
 
-    return best_solution, best_fitness, optimal_solution, optimal_cost, error, last_update_iteration
+# Le GUI non eseguono mai il solver nel thread di Tk: il lavoro gira in un processo separato che manda gli eventi
+# (tipo, payload) su una coda, letta dal ciclo di Tk con after() ogni GUI_REFRESH_INTERVAL secondi. Gli eventi
+# 'result' ed 'error' chiudono l'esecuzione, gli altri ('coords', 'progress') alimentano i grafici
+
+def solver_worker(file_path, params, events, cancel):
+    # Eseguito nel processo di lavoro, progress è già limitato dal solver a un evento ogni GUI_REFRESH_INTERVAL secondi
+    try:
+        _, distances, _, _ = load_instance(file_path)
+        if is_coordinate_backed(distances):
+            coords, edge_weight_type = np.array(distances['coords']), distances['edge_weight_type']
+        else:
+            coords, edge_weight_type = node_coordinates(file_path)
+        # Le istanze GEO hanno (latitudine, longitudine): la longitudine va sull'asse x
+        if coords is not None and edge_weight_type == "GEO":
+            coords = coords[:, ::-1]
+        events.put(('coords', coords))
+        result = solve(file_path, params, progress=lambda progress: events.put(('progress', progress)),
+                       progress_interval=GUI_REFRESH_INTERVAL, cancel=cancel)
+        events.put(('result', result))
+    except Exception:
+        events.put(('error', traceback.format_exc()))
+
+def start_worker(target, *args):
+    context = multiprocessing.get_context()
+    worker = {'events': context.Queue(), 'cancel': context.Event()}
+    worker['process'] = context.Process(target=target, args=(*args, worker['events'], worker['cancel']))
+    worker['process'].start()
+    return worker
+
+def poll_worker(window, worker, on_events, on_done):
+    # Svuoto la coda e passo a on_events tutti gli eventi arrivati dall'ultimo giro, così ridisegno al massimo una volta
+    # per giro; on_done riceve ('result' o 'error', payload) e chiude il polling
+    received = []
+    while True:
+        try:
+            kind, payload = worker['events'].get_nowait()
+        except queue.Empty:
+            break
+        if kind in ('result', 'error'):
+            if received:
+                on_events(received)
+            worker['process'].join()
+            on_done(kind, payload)
+            return
+        received.append((kind, payload))
+    if received:
+        on_events(received)
+    if not worker['process'].is_alive() and worker['events'].empty():
+        on_done('error', f"The worker process exited with code {worker['process'].exitcode}")
+        return
+    window.after(int(GUI_REFRESH_INTERVAL * 1000), poll_worker, window, worker, on_events, on_done)
+
+def draw_tour(canvas, coords, tour):
+    # Tour chiuso in una sola polilinea, coordinate scalate mantenendo le proporzioni (y verso l'alto)
+    canvas.delete("all")
+    width, height = int(canvas['width']), int(canvas['height'])
+    low, high = coords.min(axis=0), coords.max(axis=0)
+    scale = (min(width, height) - 2 * PLOT_MARGIN) / max((high - low).max(), 1e-9)
+    points = coords[np.append(tour, tour[0])]
+    x = PLOT_MARGIN + (points[:, 0] - low[0]) * scale
+    y = height - PLOT_MARGIN - (points[:, 1] - low[1]) * scale
+    canvas.create_line(*np.column_stack((x, y)).ravel().tolist(), fill="#1f6aa5")
+    if len(tour) <= MAX_DRAWN_CITIES:
+        for city_x, city_y in zip(x[:-1].tolist(), y[:-1].tolist()):
+            canvas.create_oval(city_x - 2, city_y - 2, city_x + 2, city_y + 2, fill="black", outline="")
+
+def draw_convergence(canvas, history):
+    # Fitness migliore e media dello sciame rispetto all'iterazione, al massimo un punto per pixel di larghezza
+    canvas.delete("all")
+    if len(history) < 2:
+        return
+    width, height = int(canvas['width']), int(canvas['height'])
+    history = np.array(history, dtype=float)
+    if len(history) > width:
+        history = history[np.linspace(0, len(history) - 1, width).astype(int)]
+    iterations, best, mean = history.T
+    low, high = best.min(), max(mean.max(), best.max())
+    x = PLOT_MARGIN + (iterations - iterations[0]) / max(iterations[-1] - iterations[0], 1) * (width - 2 * PLOT_MARGIN)
+    for values, color in ((mean, "gray"), (best, "#1f6aa5")):
+        y = height - PLOT_MARGIN - (values - low) / max(high - low, 1e-9) * (height - 2 * PLOT_MARGIN)
+        canvas.create_line(*np.column_stack((x, y)).ravel().tolist(), fill=color)
+    canvas.create_text(PLOT_MARGIN, PLOT_MARGIN / 2, anchor="w", text=f"best {best[-1]:.0f}", fill="#1f6aa5")
+    canvas.create_text(width - PLOT_MARGIN, PLOT_MARGIN / 2, anchor="e", text=f"mean {mean[-1]:.0f}", fill="gray")
+    canvas.create_text(width / 2, height - PLOT_MARGIN / 2, text=f"iteration {iterations[-1]:.0f}")
 
 def create_gui():
     window = ctk.CTk()
@@ -107,6 +99,8 @@ def create_gui():
     print_optimum_var = ctk.BooleanVar(value=False)
     variable_w = ctk.BooleanVar(value=False)
     confinement = ctk.BooleanVar(value=False)
+    running = {'worker': None}
+    view = {'coords': None, 'drawn_fitness': None, 'history': []}
 
     # Funzione chiamata quando si preme il pulsante Run PSO
     def run_pso():
@@ -135,11 +129,51 @@ def create_gui():
             result_label.configure(text="Select a value between 0 and 2 for the variable c2")
             return
 
+        params = {'num_particles': num_particles, 'max_iterations': max_iterations, 'w': w, 'c1': c1, 'c2': c2, 'variable_w': variable_w.get()}
+        print(f"Now running with: w = {w}, c1 = {c1}, c2 = {c2}, num_particles = {num_particles}, max_iterations = {max_iterations}, variable w {params['variable_w']}")
+        progress_bar.set(0)
         result_label.configure(text="Running...")
-        window.update()
-        best_solution, best_fitness, optimal_solution, optimal_cost, error, last_update_iteration = pso_tsp(file_path, num_particles, max_iterations, w, c1, c2, variable_w.get(), result_label, window, progress_bar)
+        run_button.configure(state="disabled")
+        cancel_button.configure(state="normal")
+        view.update({'coords': None, 'drawn_fitness': None, 'history': []})
+        tour_canvas.delete("all")
+        convergence_canvas.delete("all")
+        running['worker'] = start_worker(solver_worker, file_path, params)
+        poll_worker(window, running['worker'], show_progress, show_result)
+
+    def show_progress(events):
+        progress = None
+        for kind, payload in events:
+            if kind == 'coords':
+                view['coords'] = payload
+            elif kind == 'progress':
+                progress = payload
+                view['history'].append((progress['iteration'], progress['best_fitness'], progress['mean_fitness']))
+        if progress is None:
+            return
+        progress_bar.set(progress['iteration'] / progress['max_iterations'])
+        result_label.configure(text=f"Running...\nUpdated best solution at iteration: {progress['last_update_iteration']} with fitness of {progress['best_fitness']}")
+        # Il tour viene ridisegnato solo quando il best globale cambia
+        if view['coords'] is not None and progress['best_tour'] is not None and progress['best_fitness'] != view['drawn_fitness']:
+            draw_tour(tour_canvas, view['coords'], progress['best_tour'])
+            view['drawn_fitness'] = progress['best_fitness']
+        draw_convergence(convergence_canvas, view['history'])
+
+    def show_result(kind, result):
+        running['worker'] = None
+        run_button.configure(state="normal")
+        cancel_button.configure(state="disabled")
+        if kind == 'error':
+            result_label.configure(text=f"The solver stopped with an error:\n{result}")
+            return
+        best_solution, optimal_solution, error = result['best_solution'], result['optimal_solution'], result['error']
+        progress_bar.set(result['iterations'] / result['params']['max_iterations'])
 
-        result_text = f"TSP file name: {file_path.split('/')[-1]}\nLast update of the fitness at iteration: {last_update_iteration}\nBest TSP fitness found: {best_fitness}\nOptimum TSP fitness: {optimal_cost}\nError from optimum: {error:.2f}%"
+        result_text = f"TSP file name: {result['instance'].split('/')[-1]}\nLast update of the fitness at iteration: {result['last_update_iteration']}\nBest TSP fitness found: {result['best_fitness']}\nOptimum TSP fitness: {result['optimal_cost']}"
+        if error is not None:
+            result_text += f"\nError from optimum: {error:.2f}%"
+        if result['stop_reason'] == 'cancelled':
+            result_text += f"\nCancelled at iteration: {result['iterations']}"
 
         if len(best_solution) > 60:
             num_elem = 40
@@ -149,11 +183,25 @@ def create_gui():
             solution_string = "\n".join([f"{best_solution[i:i+num_elem]}" for i in range(0, len(best_solution), num_elem)])
             result_text += f"\nBest TSP solution: {solution_string}"
             
-        if print_optimum_var.get():
+        if print_optimum_var.get() and optimal_solution is not None:
             optimal_solution_string = "\n".join([f"{optimal_solution[i:i+num_elem]}" for i in range(0, len(optimal_solution), num_elem)])
             result_text += f"\nOptimum TSP solution: {optimal_solution_string}"
         
         result_label.configure(text=result_text)  
+
+    def cancel_pso():
+        # Il solver si ferma alla fine dell'iterazione corrente e restituisce il miglior tour trovato fino a lì
+        if running['worker'] is not None:
+            running['worker']['cancel'].set()
+            cancel_button.configure(state="disabled")
+            result_label.configure(text="Cancelling...")
+
+    def close_window():
+        if running['worker'] is not None:
+            running['worker']['process'].terminate()
+        window.destroy()
+
+    window.protocol("WM_DELETE_WINDOW", close_window)
     
     # Interfaccia utente
     file_path_var = ctk.StringVar()
@@ -184,12 +232,17 @@ def create_gui():
     print_optimum_checkbox = ctk.CTkCheckBox(window, text="Print Optimum solution", variable=print_optimum_var)
 
     run_button = ctk.CTkButton(window, text="Run PSO", command=run_pso)
+    cancel_button = ctk.CTkButton(window, text="Cancel", command=cancel_pso, state="disabled")
     
     progress_bar = ctk.CTkProgressBar(window, orientation="orizontal", width=300, determinate_speed=0.5)
     progress_bar.set(0)
 
     result_label = ctk.CTkLabel(window, text="Results will be displayed here.")
 
+    # Tour migliore corrente e andamento della fitness, aggiornati dagli eventi del solver
+    tour_canvas = ctk.CTkCanvas(window, width=360, height=360, bg="white", highlightthickness=0)
+    convergence_canvas = ctk.CTkCanvas(window, width=360, height=180, bg="white", highlightthickness=0)
+
     # Layout dell'interfaccia utente
     file_path_label.grid(row=0, column=0, padx=10, pady=5, sticky=ctk.E)
     file_path_entry.grid(row=0, column=1, padx=5, pady=5, sticky=ctk.W)
@@ -216,12 +269,16 @@ def create_gui():
     
     print_optimum_checkbox.grid(row=6, column=2, columnspan=3, padx=5, pady=5, sticky=ctk.W)
 
-    run_button.grid(row=8, column=0, columnspan=3, pady=10)
+    run_button.grid(row=8, column=0, columnspan=2, pady=10)
+    cancel_button.grid(row=8, column=2, pady=10)
     
     progress_bar.grid(row=9, column=0, columnspan=3, pady=10)
 
     result_label.grid(row=10, column=0, columnspan=3, pady=10)
 
+    tour_canvas.grid(row=0, column=3, rowspan=8, padx=10, pady=5)
+    convergence_canvas.grid(row=8, column=3, rowspan=3, padx=10, pady=5, sticky=ctk.N)
+
     window.mainloop()
 
 # Funzione per il pulsante di navigazione per selezionare un file TSP
@@ -229,6 +286,11 @@ def browse_file(entry_var):
     file_path = filedialog.askopenfilename(filetypes=[("TSP Files", "*.tsp")])
     entry_var.set(file_path)
 
+# Intervallo tra due eventi del solver e tra due ridisegni: al massimo 10 aggiornamenti della finestra al secondo
+GUI_REFRESH_INTERVAL = 0.1
+PLOT_MARGIN = 20
+MAX_DRAWN_CITIES = 1000
+
 if __name__ == "__main__":
     # Parametri di default
     max_iterations = 5000
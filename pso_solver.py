@@ -0,0 +1,367 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+from tsp_instance import *
+from local_search import nearest_neighbors, improve_tour, keys_for_tour
+from instrumentation import new_profiler, record_phase, record_best, count, profile_summary, write_profile
+from checkpoint import save_checkpoint, load_checkpoint
+
+
+# Parametri di default del solver. I criteri di arresto anticipato sono disattivati con None:
+# stagnation_iterations (iterazioni senza miglioramenti del best globale), target_error (errore % dall'ottimo noto),
+# min_diversity (deviazione standard media delle chiavi tra le particelle) e time_limit (secondi di calcolo).
+# La fase memetica (2-opt/Or-opt sulle local_search_top_k particelle migliori ogni local_search_interval iterazioni)
+# è disattivata con local_search_interval None. Con profile True il ciclo registra tempi per fase, contatori e andamento del best
+DEFAULT_PARAMS = {'num_particles': 20, 'max_iterations': 5000, 'w': 0.7, 'c1': 1.43, 'c2': 1.43, 'variable_w': False,
+                  'stagnation_iterations': None, 'target_error': None, 'min_diversity': None, 'time_limit': None,
+                  'local_search_interval': None, 'local_search_top_k': 1, 'neighbor_list_size': 10, 'or_opt': True,
+                  'profile': False}
+
+def random_generator(seed=None):
+    # seed può essere None (entropia dal sistema), un intero o una SeedSequence già derivata con spawn (isole, prove).
+    # Restituisco anche la SeedSequence, che permette di registrare il seed effettivo nel risultato
+    seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    return seed_sequence, np.random.default_rng(seed_sequence)
+
+def initialize_particles(num_particles, num_cities, rng):
+    # Lo sciame è un dizionario di matrici contigue (num_particles, num_cities)
+    values = rng.random((num_particles, 2, num_cities))
+    swarm = {'position': values[:, 0].copy(),
+             'velocity': values[:, 1].copy(),
+             'fitness': np.full(num_particles, np.inf),
+             'best_position': values[:, 0].copy(),
+             'best_fitness': np.full(num_particles, np.inf),
+             'tour': None,
+             'evaluations': {'full': 0}}
+    return swarm
+
+def random_key_to_tsp_solution(random_key, cities):
+    sorted_cities = [cities[k] for k in np.argsort(random_key, kind='stable')]
+    return sorted_cities
+
+def has_ties(sorted_keys):
+    return np.any(sorted_keys[:, 1:] == sorted_keys[:, :-1], axis=1)
+
+def full_rank(positions):
+    # L'introsort è più veloce dell'ordinamento stabile, quest'ultimo serve solo per le righe con chiavi uguali
+    # (a parità di chiave vince l'indice minore, come con sorted(zip(random_key, cities)))
+    tours = np.argsort(positions, axis=1)
+    ties = has_ties(np.take_along_axis(positions, tours, axis=1))
+    if ties.any():
+        tours[ties] = np.argsort(positions[ties], axis=1, kind='stable')
+    return tours
+
+def random_keys_to_tours(positions):
+    # Decodifico tutto lo sciame in una matrice di indici (num_particles, num_cities) con un solo argsort per righe.
+    # Riordinare a partire dal tour precedente costa di più: il controllo delle chiavi spostate è già O(n) per riga
+    # e dopo un aggiornamento delle velocità quasi nessuna riga resta ordinata
+    return full_rank(positions)
+
+def minmax_scale_rows(positions):
+    # Riscalo ogni particella in [0, 1] con le stesse operazioni di sklearn.preprocessing.minmax_scale
+    data_min = positions.min(axis=1, keepdims=True)
+    data_range = positions.max(axis=1, keepdims=True) - data_min
+    data_range[data_range < 10 * np.finfo(float).eps] = 1.0
+    scale = 1 / data_range
+    positions *= scale
+    positions += 0 - data_min * scale
+    return positions
+
+def evaluate_particles(swarm, global_best_particle, distances, profiler=None):
+    if profiler is not None:
+        phase_start = time.perf_counter()
+    swarm['tour'] = random_keys_to_tours(swarm['position'])
+    if profiler is not None:
+        phase_start = record_phase(profiler, 'decode', phase_start)
+    # Un solo gather per tutto lo sciame: aggiornare solo gli archi cambiati costa di più del ricalcolo completo
+    swarm['fitness'] = tsp_fitness(swarm['tour'], distances).astype(float)
+    swarm['evaluations']['full'] += len(swarm['fitness'])
+    if profiler is not None:
+        record_phase(profiler, 'cost', phase_start)
+        count(profiler, 'particle_evaluations', len(swarm['fitness']))
+
+    # Aggiorno la miglior posizione di ogni particella
+    improved = swarm['fitness'] < swarm['best_fitness']
+    swarm['best_fitness'][improved] = swarm['fitness'][improved]
+    swarm['best_position'][improved] = swarm['position'][improved]
+
+    # Aggiorno la miglior posizione globale, a parità di fitness vince la prima particella come nel ciclo originale
+    best = int(np.argmin(swarm['fitness']))
+    if swarm['fitness'][best] < global_best_particle['fitness']:
+        global_best_particle['fitness'] = swarm['fitness'][best].item()
+        global_best_particle['position'] = swarm['position'][best].copy()
+        return True
+    return False
+
+def local_search_step(swarm, global_best_particle, distances, neighbors, top_k, or_opt):
+    # Miglioro i tour delle top_k particelle e riscrivo le loro chiavi, così lo sciame continua a imparare dal tour migliorato
+    improved_global = False
+    for k in np.argsort(swarm['fitness'], kind='stable')[:top_k]:
+        tour, delta = improve_tour(swarm['tour'][k], distances, neighbors, or_opt)
+        if delta >= 0:
+            continue
+        swarm['position'][k] = keys_for_tour(swarm['position'][k], tour)
+        swarm['tour'][k] = tour
+        swarm['fitness'][k] = tsp_fitness(tour, distances)
+        if swarm['fitness'][k] < swarm['best_fitness'][k]:
+            swarm['best_fitness'][k] = swarm['fitness'][k]
+            swarm['best_position'][k] = swarm['position'][k]
+        if swarm['fitness'][k] < global_best_particle['fitness']:
+            global_best_particle['fitness'] = swarm['fitness'][k].item()
+            global_best_particle['position'] = swarm['position'][k].copy()
+            improved_global = True
+    return improved_global
+
+def update_particles(swarm, best_particle, w, c1, c2, rng):
+    # r1 e r2 per tutto lo sciame generati in blocco, una sola chiamata al generatore per iterazione
+    r1, r2 = rng.random((2, *swarm['position'].shape))
+    position = swarm['position']
+    swarm['velocity'] = w * swarm['velocity'] + c1 * r1 * (best_particle['position'] - position) + c2 * r2 * (swarm['best_position'] - position)
+    swarm['position'] = minmax_scale_rows(position + swarm['velocity'])
+
+def start_run(instance, params=None, seed=None):
+    # Stato completo di un'esecuzione: può essere fatto avanzare a tappe con run_iterations, anche in processi diversi,
+    # con lo stesso risultato di un'esecuzione senza interruzioni
+    params = {**DEFAULT_PARAMS, **(params or {})}
+    seed_sequence, rng = random_generator(seed)
+    cities = load_instance(instance)[0]
+    swarm = initialize_particles(params['num_particles'], len(cities), rng)
+    return {'instance': str(instance),
+            'params': params,
+            'seed': seed_sequence.entropy,
+            'spawn_key': list(seed_sequence.spawn_key),
+            'swarm': swarm,
+            'global_best_particle': {'position': None, 'fitness': float('inf')},
+            'iteration': 0,
+            'w': params['w'],
+            'last_update_iteration': 0,
+            'elapsed_time': 0.0,
+            'stop_reason': None,
+            'profiler': new_profiler() if params['profile'] else None,
+            'rng': rng,
+            'neighbors': None}
+
+def swarm_diversity(swarm):
+    return swarm['position'].std(axis=0).mean().item()
+
+def stop_reason(state, iteration, optimal_cost, elapsed_time):
+    # Restituisce il primo criterio di arresto soddisfatto, None se l'esecuzione deve continuare
+    params, swarm = state['params'], state['swarm']
+    if params['target_error'] is not None and optimal_cost is not None and \
+            (state['global_best_particle']['fitness'] - optimal_cost) / optimal_cost * 100 <= params['target_error']:
+        return 'target_error'
+    if params['stagnation_iterations'] is not None and iteration - state['last_update_iteration'] >= params['stagnation_iterations']:
+        return 'stagnation'
+    if params['min_diversity'] is not None and swarm_diversity(swarm) <= params['min_diversity']:
+        return 'diversity'
+    if params['time_limit'] is not None and elapsed_time >= params['time_limit']:
+        return 'time_limit'
+    if iteration == params['max_iterations'] - 1:
+        return 'max_iterations'
+    return None
+
+def sync_state(state, w, start_time):
+    # Riporta nello stato le variabili locali del ciclo
+    state['w'] = w
+    state['elapsed_time'] += time.perf_counter() - start_time
+    return time.perf_counter()
+
+def progress_event(state, iteration):
+    # Evento passato a progress: oltre al best globale contiene la fitness media dello sciame e il tour migliore
+    # (indici della matrice), per i grafici della GUI. Viene costruito solo quando progress è chiamata
+    global_best_particle = state['global_best_particle']
+    best_tour = None
+    if global_best_particle['position'] is not None:
+        best_tour = np.argsort(global_best_particle['position'], kind='stable').astype(np.int32)
+    return {'iteration': iteration,
+            'max_iterations': state['params']['max_iterations'],
+            'best_fitness': global_best_particle['fitness'],
+            'mean_fitness': state['swarm']['fitness'].mean().item(),
+            'last_update_iteration': state['last_update_iteration'],
+            'best_tour': best_tour}
+
+def run_iterations(state, stop_iteration=None, progress=None, progress_interval=0.5, checkpoint_path=None, checkpoint_every=None, checkpoint_seconds=None, cancel=None):
+    # Esegue le iterazioni da state['iteration'] a stop_iteration (di default fino a max_iterations).
+    # progress, se presente, viene chiamata con lo stato corrente al massimo una volta ogni progress_interval secondi.
+    # cancel (un threading.Event o multiprocessing.Event) ferma l'esecuzione alla fine dell'iterazione corrente.
+    # Con checkpoint_path lo stato viene salvato ogni checkpoint_every iterazioni e/o ogni checkpoint_seconds secondi, e alla fine
+    if state['stop_reason'] is not None:
+        return state
+    params = state['params']
+    max_iterations, c1, c2, variable_w = params['max_iterations'], params['c1'], params['c2'], params['variable_w']
+    stop_iteration = max_iterations if stop_iteration is None else min(stop_iteration, max_iterations)
+    if variable_w:
+        diminishing_rate = ((params['w']) / max_iterations)
+    _, distances, _, optimal_cost = load_instance(state['instance'])
+    local_search_interval = params['local_search_interval']
+    if local_search_interval is not None:
+        # Liste dei vicini calcolate una sola volta per esecuzione e tenute nello stato, anche per chi avanza a tappe
+        if state['neighbors'] is None:
+            state['neighbors'] = nearest_neighbors(distances, params['neighbor_list_size'])
+        neighbors = state['neighbors']
+    swarm, global_best_particle = state['swarm'], state['global_best_particle']
+    w, rng = state['w'], state['rng']
+    start_time = time.perf_counter()
+    next_progress_time = start_time + progress_interval
+    if checkpoint_seconds is not None:
+        next_checkpoint_time = start_time + checkpoint_seconds
+
+    profiler = state['profiler']
+    for iteration in range(state['iteration'], stop_iteration):
+        improved = evaluate_particles(swarm, global_best_particle, distances, profiler)
+        if local_search_interval is not None and iteration % local_search_interval == 0:
+            if profiler is not None:
+                phase_start = time.perf_counter()
+            improved = local_search_step(swarm, global_best_particle, distances, neighbors, params['local_search_top_k'], params['or_opt']) or improved
+            if profiler is not None:
+                record_phase(profiler, 'local_search', phase_start)
+        if improved:
+            state['last_update_iteration'] = iteration
+            if profiler is not None:
+                record_best(profiler, iteration, global_best_particle['fitness'])
+        state['iteration'] = iteration + 1
+
+        if cancel is not None and cancel.is_set():
+            state['stop_reason'] = 'cancelled'
+        else:
+            state['stop_reason'] = stop_reason(state, iteration, optimal_cost, state['elapsed_time'] + time.perf_counter() - start_time)
+        if state['stop_reason'] is not None:
+            break
+
+        if progress is not None and time.perf_counter() >= next_progress_time:
+            progress_start = time.perf_counter()
+            progress(progress_event(state, iteration))
+            next_progress_time = time.perf_counter() + progress_interval
+            if profiler is not None:
+                record_phase(profiler, 'progress', progress_start)
+
+        # Calcolo il valore attuale di w (diminuendo linearmente da initial_w a 0)
+        if variable_w:
+            w = w - diminishing_rate
+
+        # Aggiorno le posizioni delle particelle
+        if profiler is not None:
+            phase_start = time.perf_counter()
+        update_particles(swarm, global_best_particle, w, c1, c2, rng)
+        if profiler is not None:
+            record_phase(profiler, 'move', phase_start)
+
+        if checkpoint_path is not None and ((checkpoint_every is not None and state['iteration'] % checkpoint_every == 0) or
+                                            (checkpoint_seconds is not None and time.perf_counter() >= next_checkpoint_time)):
+            start_time = sync_state(state, w, start_time)
+            save_checkpoint(state, checkpoint_path)
+            if checkpoint_seconds is not None:
+                next_checkpoint_time = time.perf_counter() + checkpoint_seconds
+
+    sync_state(state, w, start_time)
+    if checkpoint_path is not None:
+        save_checkpoint(state, checkpoint_path)
+    if progress is not None:
+        progress(progress_event(state, state['iteration']))
+    return state
+
+def run_result(state):
+    cities, _, optimal_solution, optimal_cost = load_instance(state['instance'])
+    global_best_particle = state['global_best_particle']
+
+    # La migliore soluzione è rappresentata dalla miglior particella
+    best_solution = random_key_to_tsp_solution(global_best_particle['position'], cities)
+    best_fitness = global_best_particle['fitness']
+    error = ((best_fitness - optimal_cost) / optimal_cost) * 100 if optimal_cost is not None else None
+
+    return {'instance': state['instance'],
+            'params': state['params'],
+            'seed': state['seed'],
+            'spawn_key': state['spawn_key'],
+            'best_solution': best_solution,
+            'best_fitness': best_fitness,
+            'optimal_solution': optimal_solution,
+            'optimal_cost': optimal_cost,
+            'error': error,
+            'last_update_iteration': state['last_update_iteration'],
+            'iterations': state['iteration'],
+            'stop_reason': state['stop_reason'],
+            'fitness_evaluations': {name: int(evaluations) for name, evaluations in state['swarm']['evaluations'].items()},
+            'profile': profile_summary(state['profiler']) if state['profiler'] is not None else None,
+            'elapsed_time': state['elapsed_time']}
+
+def solve(instance, params=None, progress=None, progress_interval=0.5, seed=None, checkpoint_path=None, checkpoint_every=None, checkpoint_seconds=None, cancel=None):
+    # Solver senza interfaccia grafica: instance è il percorso del file .tsp, params sovrascrive DEFAULT_PARAMS.
+    # Se checkpoint_path esiste già l'esecuzione riprende da lì
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        state = load_checkpoint(checkpoint_path)
+    else:
+        state = start_run(instance, params, seed)
+    run_iterations(state, progress=progress, progress_interval=progress_interval,
+                   checkpoint_path=checkpoint_path, checkpoint_every=checkpoint_every, checkpoint_seconds=checkpoint_seconds, cancel=cancel)
+    return run_result(state)
+
+def build_parser(prog="python -m pso_solver", description="PSO TSP solver with random key encoding"):
+    parser = argparse.ArgumentParser(prog=prog, description=description)
+    parser.add_argument("tsp_file", help="path of the .tsp instance")
+    parser.add_argument("--num-particles", type=int, default=DEFAULT_PARAMS['num_particles'])
+    parser.add_argument("--max-iterations", type=int, default=DEFAULT_PARAMS['max_iterations'])
+    parser.add_argument("--w", type=float, default=DEFAULT_PARAMS['w'], help="coefficient of inertia")
+    parser.add_argument("--c1", type=float, default=DEFAULT_PARAMS['c1'])
+    parser.add_argument("--c2", type=float, default=DEFAULT_PARAMS['c2'])
+    parser.add_argument("--variable-w", action="store_true", help="decrease w linearly to 0")
+    parser.add_argument("--stagnation", type=int, default=None, metavar="ITERATIONS", help="stop after this many iterations without improvement")
+    parser.add_argument("--target-error", type=float, default=None, metavar="PERCENT", help="stop when the error from the known optimum is at most this")
+    parser.add_argument("--min-diversity", type=float, default=None, help="stop when the mean standard deviation of the keys falls to this")
+    parser.add_argument("--time-limit", type=float, default=None, metavar="SECONDS", help="wall-clock budget of the run")
+    parser.add_argument("--local-search", type=int, default=None, metavar="INTERVAL", help="apply 2-opt/Or-opt every INTERVAL iterations")
+    parser.add_argument("--local-search-top-k", type=int, default=DEFAULT_PARAMS['local_search_top_k'], help="number of best particles improved by the local search")
+    parser.add_argument("--neighbors", type=int, default=DEFAULT_PARAMS['neighbor_list_size'], help="size of the nearest neighbor candidate lists")
+    parser.add_argument("--no-or-opt", action="store_true", help="use only 2-opt moves in the local search")
+    parser.add_argument("--profile", default=None, metavar="PATH", help="record per-phase timings and write them to PATH")
+    parser.add_argument("--profile-format", choices=["json", "chrome"], default="json", help="structured JSON summary or Chrome trace events")
+    parser.add_argument("--checkpoint", default=None, metavar="PATH", help="save the swarm state to PATH and resume from it if it exists")
+    parser.add_argument("--checkpoint-every", type=int, default=None, metavar="ITERATIONS")
+    parser.add_argument("--checkpoint-seconds", type=float, default=None, metavar="SECONDS")
+    parser.add_argument("--seed", type=int, default=None, help="seed of the random generator (default: fresh entropy, recorded in the result)")
+    parser.add_argument("--output", default=None, help="JSON output file (default: stdout)")
+    parser.add_argument("--quiet", action="store_true", help="do not print progress on stderr")
+    return parser
+
+def params_from_args(args):
+    if args.num_particles <= 0 or args.max_iterations <= 0:
+        sys.exit("num-particles and max-iterations must be greater than 0")
+    return {'num_particles': args.num_particles, 'max_iterations': args.max_iterations, 'w': args.w, 'c1': args.c1, 'c2': args.c2, 'variable_w': args.variable_w,
+              'stagnation_iterations': args.stagnation, 'target_error': args.target_error, 'min_diversity': args.min_diversity, 'time_limit': args.time_limit,
+              'local_search_interval': args.local_search, 'local_search_top_k': args.local_search_top_k, 'neighbor_list_size': args.neighbors, 'or_opt': not args.no_or_opt,
+              'profile': args.profile is not None}
+
+def write_result(result, output):
+    if output is None:
+        print(json.dumps(result, indent=2))
+    else:
+        with open(output, "w") as output_file:
+            json.dump(result, output_file, indent=2)
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    params = params_from_args(args)
+
+    def print_progress(progress):
+        print(f"Iteration {progress['iteration']}/{progress['max_iterations']} best fitness: {progress['best_fitness']}", file=sys.stderr)
+
+    if args.checkpoint is not None and os.path.exists(args.checkpoint):
+        # Riprendo l'esecuzione interrotta: parametri e seed sono quelli salvati nel checkpoint
+        state = load_checkpoint(args.checkpoint)
+        print(f"Resuming from {args.checkpoint} at iteration {state['iteration']}", file=sys.stderr)
+        # Il checkpoint può essere stato scritto senza --profile: in quel caso profilo solo la parte ripresa
+        if args.profile is not None and state['profiler'] is None:
+            state['profiler'] = new_profiler()
+    else:
+        state = start_run(args.tsp_file, params, args.seed)
+    run_iterations(state, progress=None if args.quiet else print_progress,
+                   checkpoint_path=args.checkpoint, checkpoint_every=args.checkpoint_every, checkpoint_seconds=args.checkpoint_seconds)
+    write_result(run_result(state), args.output)
+    if args.profile is not None:
+        write_profile(state['profiler'], args.profile, args.profile_format)
+
+if __name__ == "__main__":
+    main()
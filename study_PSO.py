@@ -1,54 +1,17 @@
 from particle_swarm import *
-import pandas as pd
+from study_store import *
 import pathlib
 import concurrent.futures
 import sys
-import threading
+import traceback
 import psutil
 import os
 
 
-def pso_tsp_thread(file_path, num_particles, max_iterations, w, c1, c2, variable_w, confinement):
-    if variable_w:
-        diminishing_rate = ((w) / max_iterations)
-    cities, distances = read_tsp_instance(file_path)
-    num_cities = len(cities)
-
-    particles = initialize_particles(num_particles, num_cities)
-    global_best_particle = {'position': None, 'fitness': float('inf')}
-    last_update_iteration = 0
-    
-    for iteration in range(max_iterations):     
-        for particle in particles:
-            tsp_solution = random_key_to_tsp_solution(particle['position'], cities)
-            particle['fitness'] = tsp_fitness(tsp_solution, distances)
-
-            # Aggiorno la miglior posizione della particella
-            if particle['fitness'] < particle['best_fitness']:
-                particle['best_fitness'] = particle['fitness']
-                particle['best_position'] = particle['position']
-
-            # Aggiorno la miglior posizione globale
-            if particle['fitness'] < global_best_particle['fitness']:
-                last_update_iteration = iteration
-                global_best_particle['fitness'] = particle['fitness']
-                global_best_particle['position'] = particle['position']
-
-        # Calcolo il valore attuale di w (diminuendo linearmente da initial_w a 0)
-        if variable_w:
-            w = w - diminishing_rate
-        
-        # Aggiorno le posizioni delle particelle
-        update_particles(particles, global_best_particle, w, c1, c2)
-
-    # La migliore soluzione è rappresentata dalla miglior particella
-    best_solution = random_key_to_tsp_solution(global_best_particle['position'], cities)
-    best_fitness = global_best_particle['fitness']
-    optimal_solution = get_optimal_path(file_path)
-    optimal_cost = tsp_fitness(optimal_solution, distances)
-    error = ((best_fitness - optimal_cost) / optimal_cost) * 100
-
-    return best_solution, best_fitness, optimal_solution, optimal_cost, error, last_update_iteration
+def pso_tsp_thread(file_path, num_particles, max_iterations, w, c1, c2, variable_w, confinement, seed=None):
+    params = {'num_particles': num_particles, 'max_iterations': max_iterations, 'w': w, 'c1': c1, 'c2': c2, 'variable_w': variable_w}
+    result = solve(file_path, params, seed=seed)
+    return result['best_solution'], result['best_fitness'], result['optimal_solution'], result['optimal_cost'], result['error'], result['last_update_iteration']
 
 def terminate_children():
     # Elimino tutti i processi figli generati dal programma
@@ -60,21 +23,73 @@ def terminate_children():
         except psutil.NoSuchProcess:
             pass
 
-def run_tsp_parallel(problem_path, num_particles, max_iterations, w, c1, c2, variable_w):
-    _, best_fitness, _, optimal_cost, error, last_update_iteration = pso_tsp_thread(problem_path, num_particles, max_iterations, w, c1, c2, variable_w)
-    data_row = pd.DataFrame({"best_fitness": [best_fitness], "optimal_cost": [optimal_cost], "error": [error], "last_update_iteration": [last_update_iteration]})
+def run_tsp_parallel(problem_path, num_particles, max_iterations, w, c1, c2, variable_w, seed, confinement=False):
+    # seed è la SeedSequence della prova (trial_seed): ogni prova ha il proprio flusso, i processi del pool non condividono lo stato casuale
+    _, best_fitness, _, optimal_cost, error, last_update_iteration = pso_tsp_thread(problem_path, num_particles, max_iterations, w, c1, c2, variable_w, confinement, seed)
+    data_row = {"seed": seed.entropy, "spawn_key": list(seed.spawn_key), "best_fitness": best_fitness, "optimal_cost": optimal_cost, "error": error, "last_update_iteration": last_update_iteration}
     return data_row
 
+def schedule_trials(problems_paths, params_list, num_iterations, study_seed, completed=()):
+    # Una prova (problema, ripetizione, parametri, SeedSequence) per ogni combinazione, le istanze più grandi vanno in coda
+    # per prime così la prova più lenta non resta da sola alla fine. Caricare le istanze qui prepara anche la cache per i worker.
+    # L'indice del problema nel flusso della prova segue l'ordine dei nomi, che non dipende dall'ordine di glob.
+    # Le prove già presenti in completed (chiavi di trial_key) vengono saltate
+    sizes = {str(problem_path): len(load_instance(str(problem_path))[0]) for problem_path in problems_paths}
+    problem_indices = {problem: index for index, problem in enumerate(sorted(sizes, key=lambda problem: pathlib.Path(problem).name))}
+    trials = [(problem, repetition, params, trial_seed(study_seed, problem_indices[problem], repetition, params_index))
+              for problem in sizes for params_index, params in enumerate(params_list) for repetition in range(num_iterations)
+              if trial_key(pathlib.Path(problem).name, repetition, params, study_seed) not in completed]
+    trials.sort(key=lambda trial: sizes[trial[0]], reverse=True)
+    return trials
+
+def run_study(trials, max_workers=None, cancel=None):
+    # Tutte le prove finiscono in un'unica coda del pool, i risultati sono restituiti appena pronti.
+    # Con cancel impostato le prove ancora in coda vengono annullate, quelle già partite arrivano alla fine
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        futures = {executor.submit(run_tsp_parallel, problem, **params, seed=seed): (problem, repetition, params)
+                   for problem, repetition, params, seed in trials}
+        for future in concurrent.futures.as_completed(futures):
+            if cancel is not None and cancel.is_set():
+                for pending in futures:
+                    pending.cancel()
+            if future.cancelled():
+                continue
+            yield futures[future], future.result()
+
+def study_worker(problems_paths, params, num_iterations, study_seed, events, cancel):
+    # Eseguito nel processo di lavoro della GUI: salva ogni prova nell'archivio e manda l'avanzamento sulla coda
+    try:
+        store = open_store()
+        trials = schedule_trials(problems_paths, [params], num_iterations, study_seed, completed_trials(store))
+        if len(trials) < num_iterations * len(problems_paths):
+            print(f"Resuming study: {num_iterations * len(problems_paths) - len(trials)} trials already in {STORE_PATH}")
+        for completed, ((problem, repetition, _), data_row) in enumerate(run_study(trials, cancel=cancel), start=1):
+            problem_name = pathlib.Path(problem).name
+            print(f"Trial n.{repetition} for {problem_name} completed ({completed}/{len(trials)})")
+            append_result(store, problem_name, repetition, params, data_row)
+            events.put(('progress', {'completed': completed, 'total': len(trials)}))
+
+        summary = study_summary(store, params, [problem.name for problem in problems_paths], num_iterations, study_seed)
+        store.close()
+
+        if cancel.is_set():
+            result_string = "Study cancelled, the completed trials are saved and will be skipped when the study is run again.\n"
+        else:
+            result_string = f"Total trials: {num_iterations*len(problems_paths)} each problem was solved {num_iterations} times (study seed {study_seed}).\n"
+
+        for result in summary.itertuples():
+            result_string += f"Problem: {result.problem} Num iterations per solve: {params['max_iterations']}\n   Mean fitness: {result.mean_fitness:.1f} Optimal cost: {result.optimal_cost} Mean error: {result.mean_error:.1f} Mean last update iteration: {result.mean_last_update_iteration:.1f}   \n"
+        print(result_string)
+        events.put(('result', result_string))
+    except Exception:
+        events.put(('error', traceback.format_exc()))
+
 def study_gui():
     window = ctk.CTk()
     window.resizable(False,False)
     window.title("PSO study TSP Solver")
     variable_w = ctk.BooleanVar(value=False)
-    
-    def run_pso_study():
-        # Creo un thread per eseguire la funzione in background e lasciare la finestra utilizzabile
-        thread = threading.Thread(target=pso_study)
-        thread.start()
+    running = {'worker': None}
     
     def chiudi_finestra():
         print("Exit requested. Wait for the termination of the processes.")
@@ -84,7 +99,7 @@ def study_gui():
     
     window.protocol("WM_DELETE_WINDOW", chiudi_finestra)
 
-    def pso_study():
+    def run_pso_study():
         num_particles = int(num_particles_entry.get())
         if num_particles <= 0:
             result_label.configure(text="Select a value greather than 0 for the number of particles")
@@ -109,69 +124,43 @@ def study_gui():
         if num_iterations <= 0:
             result_label.configure(text="Select a value greather than 0 for the number of iterations")
             return
+        # Con lo stesso seed uno studio interrotto riprende, con un seed diverso è una replica indipendente
+        study_seed = int(study_seed_entry.get())
+        if study_seed < 0 or study_seed >= 2**63:
+            result_label.configure(text="Select a value between 0 and 2^63 - 1 for the study seed")
+            return
         
         variable_w_value = variable_w.get()
         
-        # Disabilito il pulsante durante l'esecuzione della funzione
+        # Disabilito il pulsante durante l'esecuzione dello studio, che gira in un processo separato
         run_button.configure(state="disabled")
-        
+        cancel_button.configure(state="normal")
         result_label.configure(text="Running...")
-        window.update()
-
-        problems_paths = list(pathlib.Path('Problems').glob('*.tsp'))
-
-        results = {problem.name: {"solutions": pd.DataFrame(columns=["best_fitness", "optimal_cost", "error", "last_update_iteration"])} for problem in problems_paths}
-
-        with concurrent.futures.ProcessPoolExecutor(max_workers=4) as executor:
-            num_iterations_ref = num_iterations
-            if num_iterations < 4:
-                num_iterations_ref = 4
-            speed = float(100) / float(len(problems_paths) * int(num_iterations_ref / 4))
-            progress_bar.configure(determinate_speed=speed/2)
-            progress_bar.set(0)
-            for problem_path in problems_paths:
-                futures = []
-                problem_name = str(problem_path.name)
-                print(f"Study of problem {problem_name} started...")
-                results[problem_name]["solutions"] = results[problem_name]["solutions"].dropna(axis=1, how='all')
-
-                for i in range(0, num_iterations, 4):
-                    # Seleziona 4 iterazioni per l'iterazione corrente
-                    current_iterations = range(i, min(i + 4, num_iterations))
-                    try:
-                        for j in current_iterations:
-                            # Faccio partire i 4 processi figli
-                            print(f"Created process n.{j} for {problem_name}")
-                            future = executor.submit(run_tsp_parallel, str(problem_path.absolute()), num_particles, max_iterations, w, c1, c2, variable_w_value)
-                            futures.append(future)
-
-                        # Attendo il termine dei processi correnti
-                        concurrent.futures.wait(futures, timeout=None, return_when=concurrent.futures.FIRST_EXCEPTION)
-
-                        for future in futures:
-                            # Concateno i DataFrames
-                            results[problem_name]["solutions"] = pd.concat([results[problem_name]["solutions"], future.result()])
-                    
-                    except KeyboardInterrupt:
-                        print("Exit requested. Wait for the termination of the processes.")
-                        terminate_children()
-                        sys.exit(0)
-                    progress_bar.step()
-            progress_bar.set(100)
-
-        result_string = f"Total trials: {num_iterations*len(problems_paths)} each problem was solved {num_iterations} times.\n"
-
-        for result in results:
-            mean_fitness = results[result]["solutions"]["best_fitness"].mean()
-            mean_error = results[result]["solutions"]["error"].mean()
-            optimal_cost = results[result]["solutions"]["optimal_cost"].iloc[0]
-            mean_last_update_iteration = results[result]["solutions"]["last_update_iteration"].mean()
-            result_string += f"Problem: {result} Num iterations per solve: {max_iterations}\n   Mean fitness: {mean_fitness:.1f} Optimal cost: {optimal_cost} Mean error: {mean_error:.1f} Mean last update iteration: {mean_last_update_iteration:.1f}   \n"
-        
-        print(result_string)
-        result_label.configure(text=result_string)
-        window.update()
+        progress_bar.set(0)
+
+        problems_paths = [problem_path.absolute() for problem_path in pathlib.Path('Problems').glob('*.tsp')]
+        params = {'num_particles': num_particles, 'max_iterations': max_iterations, 'w': w, 'c1': c1, 'c2': c2, 'variable_w': variable_w_value}
+        running['worker'] = start_worker(study_worker, problems_paths, params, num_iterations, study_seed)
+        poll_worker(window, running['worker'], show_progress, show_result)
+
+    def show_progress(events):
+        _, progress = events[-1]
+        progress_bar.set(progress['completed'] / progress['total'])
+
+    def show_result(kind, result):
+        running['worker'] = None
         run_button.configure(state="normal")
+        cancel_button.configure(state="disabled")
+        if kind == 'error':
+            result_label.configure(text=f"The study stopped with an error:\n{result}")
+            return
+        result_label.configure(text=result)
+
+    def cancel_study():
+        if running['worker'] is not None:
+            running['worker']['cancel'].set()
+            cancel_button.configure(state="disabled")
+            result_label.configure(text="Cancelling: waiting for the running trials to finish...")
 
     # Interfaccia utente
     num_particles_label = ctk.CTkLabel(window, text="Number of particles:")
@@ -194,7 +183,11 @@ def study_gui():
     num_iterations_label = ctk.CTkLabel(window, text="# of iterations per problem:")
     num_iterations_entry = ctk.CTkEntry(window, textvariable=ctk.StringVar(value=num_iterations), width=40)
 
+    study_seed_label = ctk.CTkLabel(window, text="Study seed:")
+    study_seed_entry = ctk.CTkEntry(window, textvariable=ctk.StringVar(value=study_seed), width=60)
+
     run_button = ctk.CTkButton(window, text="Run study PSO", command=run_pso_study)
+    cancel_button = ctk.CTkButton(window, text="Cancel", command=cancel_study, state="disabled")
     
     progress_bar = ctk.CTkProgressBar(window, orientation="orizontal", width=300)
     progress_bar.set(0)
@@ -222,7 +215,11 @@ def study_gui():
     num_iterations_label.grid(row=4, column=0, padx=10, pady=5, sticky=ctk.E)
     num_iterations_entry.grid(row=4, column=1, padx=5, pady=5, sticky=ctk.W)
 
-    run_button.grid(row=5, column=0, columnspan=4, pady=10)
+    study_seed_label.grid(row=4, column=2, padx=10, pady=5, sticky=ctk.E)
+    study_seed_entry.grid(row=4, column=3, padx=5, pady=5, sticky=ctk.W)
+
+    run_button.grid(row=5, column=0, columnspan=2, pady=10)
+    cancel_button.grid(row=5, column=2, columnspan=2, pady=10)
     
     progress_bar.grid(row=6, column=0, columnspan=4, pady=10)
 
@@ -236,6 +233,7 @@ if __name__ == "__main__":
     max_iterations = 5000
     num_particles = 20
     w, c1, c2, num_iterations = 0.7, 1.43, 1.43, 20
+    study_seed = 0
 
     # Avvia l'interfaccia utente
     study_gui()
\ No newline at end of file
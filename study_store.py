@@ -0,0 +1,81 @@
+import json
+import sqlite3
+import datetime
+import numpy as np
+import pandas as pd
+
+
+# Archivio dei risultati degli studi: una riga per prova terminata, scritta appena arriva dal pool.
+# Se lo studio si interrompe le prove già salvate non vengono ripetute alla ripartenza
+STORE_PATH = "study_results.sqlite"
+
+PARAMS_COLUMNS = ["num_particles", "max_iterations", "w", "c1", "c2", "variable_w"]
+RESULT_COLUMNS = ["best_fitness", "optimal_cost", "error", "last_update_iteration"]
+
+
+def params_key(params):
+    return json.dumps({name: params[name] for name in PARAMS_COLUMNS}, sort_keys=True)
+
+def trial_key(problem_name, repetition, params, study_seed):
+    return f"{study_seed}|{problem_name}|{repetition}|{params_key(params)}"
+
+def trial_seed(study_seed, problem_index, repetition, params_index):
+    # Flusso della prova: figlio (problem_index, repetition, params_index) del seed dello studio, indipendente da quelli
+    # delle altre prove. La stessa prova dà lo stesso risultato, uno studio con un altro seed è una replica indipendente
+    return np.random.SeedSequence(study_seed, spawn_key=(problem_index, repetition, params_index))
+
+def open_store(path=STORE_PATH):
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("""CREATE TABLE IF NOT EXISTS trials (
+        trial_key TEXT PRIMARY KEY,
+        problem TEXT NOT NULL,
+        repetition INTEGER NOT NULL,
+        params TEXT NOT NULL,
+        num_particles INTEGER, max_iterations INTEGER, w REAL, c1 REAL, c2 REAL, variable_w INTEGER,
+        seed INTEGER,
+        best_fitness REAL, optimal_cost REAL, error REAL, last_update_iteration INTEGER,
+        finished_at TEXT,
+        spawn_key TEXT)""")
+    # Gli archivi creati prima dei flussi per prova non hanno la colonna spawn_key
+    if "spawn_key" not in {row[1] for row in connection.execute("PRAGMA table_info(trials)")}:
+        connection.execute("ALTER TABLE trials ADD COLUMN spawn_key TEXT")
+    connection.commit()
+    return connection
+
+def completed_trials(connection):
+    return {row[0] for row in connection.execute("SELECT trial_key FROM trials")}
+
+def append_result(connection, problem_name, repetition, params, data_row):
+    # Ogni riga è confermata subito, così un crash perde al massimo la prova in corso.
+    # seed è il seed dello studio, spawn_key identifica il flusso della prova derivato da lì
+    values = [trial_key(problem_name, repetition, params, data_row["seed"]), problem_name, repetition, params_key(params)]
+    values += [params[name] for name in PARAMS_COLUMNS]
+    values += [data_row["seed"]] + [data_row[name] for name in RESULT_COLUMNS]
+    values += [datetime.datetime.now().isoformat(timespec="seconds"), json.dumps(data_row["spawn_key"])]
+    connection.execute(f"INSERT OR REPLACE INTO trials VALUES ({', '.join('?' * len(values))})", values)
+    connection.commit()
+
+def study_summary(connection, params=None, problems=None, num_repetitions=None, study_seed=None):
+    # Statistiche per problema calcolate dall'archivio, filtrate sui parametri, sui problemi e sul numero di ripetizioni
+    # dello studio corrente (un archivio con più ripetizioni di uno studio precedente non altera le medie)
+    query = """SELECT problem, params, COUNT(*) AS trials, AVG(best_fitness) AS mean_fitness, MIN(optimal_cost) AS optimal_cost,
+        AVG(error) AS mean_error, MIN(error) AS min_error, AVG(last_update_iteration) AS mean_last_update_iteration
+        FROM trials"""
+    conditions, arguments = [], []
+    if params is not None:
+        conditions.append("params = ?")
+        arguments.append(params_key(params))
+    if study_seed is not None:
+        conditions.append("seed = ?")
+        arguments.append(study_seed)
+    if num_repetitions is not None:
+        conditions.append("repetition < ?")
+        arguments.append(num_repetitions)
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " GROUP BY problem, params ORDER BY problem"
+    summary = pd.read_sql_query(query, connection, params=arguments)
+    if problems is not None:
+        summary = summary[summary["problem"].isin(list(problems))]
+    return summary
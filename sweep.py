@@ -0,0 +1,139 @@
+import os
+import sys
+import math
+import pathlib
+import argparse
+import itertools
+import concurrent.futures
+import pandas as pd
+from pso_solver import *
+from study_store import params_key, trial_seed
+
+
+# Valori di default della griglia dei parametri
+SWEEP_GRID = {'num_particles': [10, 20, 40],
+              'w': [0.4, 0.7, 0.9],
+              'c1': [1.0, 1.43, 2.0],
+              'c2': [1.0, 1.43, 2.0],
+              'variable_w': [False, True]}
+
+
+def grid_configurations(grid, max_iterations):
+    names = list(grid)
+    return [{**dict(zip(names, values)), 'max_iterations': max_iterations} for values in itertools.product(*grid.values())]
+
+def random_configurations(grid, max_iterations, num_samples, seed=None):
+    # Campiono num_samples configurazioni distinte: per w, c1 e c2 estraggo un valore uniforme tra il minimo e il massimo della griglia.
+    # seed può essere una SeedSequence figlia di quella dello sweep
+    rng = np.random.default_rng(seed)
+    configurations = {}
+    for _ in range(100 * num_samples):
+        if len(configurations) == num_samples:
+            break
+        params = {'num_particles': grid['num_particles'][rng.integers(len(grid['num_particles']))],
+                  'variable_w': grid['variable_w'][rng.integers(len(grid['variable_w']))], 'max_iterations': max_iterations}
+        for name in ('w', 'c1', 'c2'):
+            params[name] = round(float(rng.uniform(min(grid[name]), max(grid[name]))), 3)
+        configurations[params_key(params)] = params
+    return list(configurations.values())
+
+def advance_run(state, problem, params, seed, stop_iteration):
+    # Alla prima tappa lo stato non esiste ancora e viene creato nel worker
+    if state is None:
+        state = start_run(problem, params, seed)
+    return run_iterations(state, stop_iteration)
+
+def rung_budgets(max_iterations, eta, min_fraction):
+    budgets = []
+    fraction = min_fraction
+    while fraction < 1:
+        budgets.append(max(1, int(max_iterations * fraction)))
+        fraction *= eta
+    budgets.append(max_iterations)
+    return sorted(set(budgets))
+
+def run_error(state, optimal_cost):
+    return (state['global_best_particle']['fitness'] - optimal_cost) / optimal_cost * 100
+
+def successive_halving(problems_paths, configurations, repetitions=1, eta=3, min_fraction=1/27, max_workers=None, seed=None):
+    # Ogni configurazione gira su tutti i problemi; a ogni tappa le esecuzioni sopravvissute avanzano fino al budget
+    # della tappa e solo il miglior 1/eta delle configurazioni (errore medio rispetto al .opt.tour) passa alla successiva.
+    # Ogni esecuzione ha il flusso (problema, ripetizione, configurazione) derivato dal seed dello sweep, riportato nella classifica
+    problems = [str(problem_path) for problem_path in problems_paths]
+    sweep_seed = np.random.SeedSequence(seed).entropy
+    optimal_costs = {problem: load_instance(problem)[3] for problem in problems}
+    max_iterations = configurations[0]['max_iterations']
+    runs = {(index, problem, repetition): None for index in range(len(configurations)) for problem in problems for repetition in range(repetitions)}
+    alive = list(range(len(configurations)))
+    rows = {}
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        for rung, budget in enumerate(rung_budgets(max_iterations, eta, min_fraction)):
+            futures = {}
+            for (index, problem, repetition), state in runs.items():
+                if index in alive:
+                    params = configurations[index]
+                    run_seed = trial_seed(sweep_seed, problems.index(problem), repetition, index)
+                    futures[executor.submit(advance_run, state, problem, params, run_seed, budget)] = (index, problem, repetition)
+            for future in concurrent.futures.as_completed(futures):
+                runs[futures[future]] = future.result()
+
+            for index in alive:
+                errors = {problem: [run_error(runs[index, problem, repetition], optimal_costs[problem]) for repetition in range(repetitions)] for problem in problems}
+                rows[index] = {**configurations[index], 'rung': rung, 'iterations': budget, 'sweep_seed': sweep_seed,
+                               'mean_error': sum(sum(values) for values in errors.values()) / (len(problems) * repetitions),
+                               **{f"error_{pathlib.Path(problem).stem}": sum(values) / repetitions for problem, values in errors.items()}}
+            print(f"Rung {rung}: {len(alive)} configurations at {budget} iterations, best mean error {min(rows[index]['mean_error'] for index in alive):.2f}%", file=sys.stderr)
+
+            # Le configurazioni peggiori vengono fermate qui, le loro esecuzioni non vengono più fatte avanzare
+            alive = sorted(alive, key=lambda index: rows[index]['mean_error'])[:max(1, math.ceil(len(alive) / eta))]
+
+    ranking = pd.DataFrame(rows.values())
+    ranking = ranking.sort_values(['rung', 'mean_error'], ascending=[False, True]).reset_index(drop=True)
+    ranking.index += 1
+    return ranking
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m sweep", description="Hyperparameter sweep with successive halving over the Problems/ set")
+    parser.add_argument("--problems", nargs="+", default=None, help=".tsp files (default: every .tsp in Problems/)")
+    parser.add_argument("--max-iterations", type=int, default=DEFAULT_PARAMS['max_iterations'])
+    parser.add_argument("--repetitions", type=int, default=1, help="runs per configuration and problem")
+    parser.add_argument("--num-particles", type=int, nargs="+", default=SWEEP_GRID['num_particles'])
+    parser.add_argument("--w", type=float, nargs="+", default=SWEEP_GRID['w'])
+    parser.add_argument("--c1", type=float, nargs="+", default=SWEEP_GRID['c1'])
+    parser.add_argument("--c2", type=float, nargs="+", default=SWEEP_GRID['c2'])
+    parser.add_argument("--variable-w", choices=["no", "yes", "both"], default="both")
+    parser.add_argument("--random", type=int, default=None, metavar="N", help="sample N random configurations instead of the full grid")
+    parser.add_argument("--seed", type=int, default=None, help="seed of the random sampling and of the runs (default: fresh entropy, printed and stored in the ranking)")
+    parser.add_argument("--eta", type=int, default=3, help="keep 1/eta of the configurations at every rung")
+    parser.add_argument("--min-fraction", type=float, default=1/27, help="fraction of max-iterations of the first rung")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", default=None, help="CSV file of the ranking")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Con eta < 2 o min_fraction <= 0 la serie dei budget non arriva mai a max_iterations
+    if args.eta < 2:
+        sys.exit("eta must be at least 2")
+    if not 0 < args.min_fraction <= 1:
+        sys.exit("min-fraction must be greater than 0 and at most 1")
+    problems_paths = args.problems or sorted(pathlib.Path('Problems').glob('*.tsp'))
+    grid = {'num_particles': args.num_particles, 'w': args.w, 'c1': args.c1, 'c2': args.c2,
+            'variable_w': {"no": [False], "yes": [True], "both": [False, True]}[args.variable_w]}
+    # Un'unica SeedSequence: il campionamento usa il suo primo figlio, le esecuzioni i figli (problema, ripetizione, configurazione).
+    # Senza --seed l'entropia viene dal sistema, stamparla permette di ripetere lo sweep con --seed
+    seed_sequence = np.random.SeedSequence(args.seed)
+    if args.random is None:
+        configurations = grid_configurations(grid, args.max_iterations)
+    else:
+        configurations = random_configurations(grid, args.max_iterations, args.random, seed_sequence.spawn(1)[0])
+    print(f"Sweep of {len(configurations)} configurations on {len(problems_paths)} problems, seed {seed_sequence.entropy}", file=sys.stderr)
+
+    ranking = successive_halving(problems_paths, configurations, args.repetitions, args.eta, args.min_fraction, args.workers, seed_sequence.entropy)
+    print(ranking.to_string())
+    if args.output is not None:
+        ranking.to_csv(args.output, index_label="rank")
+
+if __name__ == "__main__":
+    main()
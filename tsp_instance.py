@@ -0,0 +1,231 @@
+import os
+import math
+import hashlib
+import tempfile
+import numpy as np
+import tsplib95
+
+
+# Oltre questo numero di città le istanze con coordinate non materializzano la matrice delle distanze (n² float):
+# tengono solo le coordinate e i CANDIDATE_GRAPH_SIZE vicini di ogni città, i costi sono calcolati al bisogno
+DENSE_MAX_CITIES = int(os.environ.get("PSO_DENSE_MAX_CITIES", 5000))
+CANDIDATE_GRAPH_SIZE = 16
+
+def get_optimal_path(file_path):
+    solution_file_path = file_path[:-3] + "opt.tour"
+    solution = tsplib95.load(solution_file_path).tours[0]
+    if tsplib95.load(file_path).edge_weight_format == "LOWER_DIAG_ROW":
+        solution = [x - 1 for x in solution]
+    return solution
+
+def coordinates_edge_costs(coords_a, coords_b, edge_weight_type):
+    # Stesse formule di tsplib95.distances, calcolate elemento per elemento (con broadcasting) tra coords_a e coords_b
+    if edge_weight_type == "GEO":
+        degrees_a, degrees_b = np.trunc(coords_a), np.trunc(coords_b)
+        radians_a = np.radians(degrees_a + (coords_a - degrees_a) * 5 / 3)
+        radians_b = np.radians(degrees_b + (coords_b - degrees_b) * 5 / 3)
+        q1 = np.cos(radians_a[..., 1] - radians_b[..., 1])
+        q2 = np.cos(radians_a[..., 0] - radians_b[..., 0])
+        q3 = np.cos(radians_a[..., 0] + radians_b[..., 0])
+        cosine = np.clip(0.5 * ((1 + q1) * q2 - (1 - q1) * q3), -1.0, 1.0)
+        return np.trunc(6378.388 * np.arccos(cosine) + 1)
+
+    deltas = coords_b - coords_a
+    square_distance = (deltas * deltas).sum(axis=-1)
+    if edge_weight_type == "ATT":
+        value = np.sqrt(square_distance / 10)
+        distance = np.trunc(value + 0.5)
+        return np.where(distance < value, distance + 1, distance)
+    return np.trunc(np.sqrt(square_distance) + 0.5)
+
+def coordinates_distance_matrix(coords, edge_weight_type):
+    return coordinates_edge_costs(coords[:, None, :], coords[None, :, :], edge_weight_type)
+
+def candidate_graph(coords, edge_weight_type, k):
+    # Le k città più vicine a ogni città (ordinate per distanza) con un KD-tree, senza calcolare tutte le coppie.
+    # Per GEO cerco sui punti della sfera unitaria: la distanza in linea retta cresce con quella sulla superficie
+    from scipy.spatial import cKDTree
+    num_cities = len(coords)
+    k = min(k, num_cities - 1)
+    points = np.asarray(coords, dtype=float)
+    if edge_weight_type == "GEO":
+        degrees = np.trunc(points)
+        radians = np.radians(degrees + (points - degrees) * 5 / 3)
+        lat, lng = radians[:, 0], radians[:, 1]
+        points = np.column_stack((np.cos(lat) * np.cos(lng), np.cos(lat) * np.sin(lng), np.sin(lat)))
+    _, candidates = cKDTree(points).query(points, k=k + 1)
+    # Tolgo la città stessa; con punti coincidenti potrebbe non essere tra i risultati e tolgo l'ultimo
+    keep = candidates != np.arange(num_cities)[:, None]
+    keep[keep.all(axis=1), -1] = False
+    return candidates[keep].reshape(num_cities, k)
+
+def is_coordinate_backed(distances):
+    return isinstance(distances, dict)
+
+def edge_costs(distances, a, b):
+    # Costo degli archi a[i] -> b[i]: letti dalla matrice oppure calcolati dalle coordinate per le istanze grandi
+    if is_coordinate_backed(distances):
+        coords = distances['coords']
+        return coordinates_edge_costs(coords[a], coords[b], distances['edge_weight_type'])
+    return distances[a, b]
+
+def edge_cost_function(distances):
+    # Versione scalare di edge_costs per i cicli in Python della ricerca locale
+    if not is_coordinate_backed(distances):
+        return distances.item
+    coords, edge_weight_type = distances['coords'], distances['edge_weight_type']
+    if edge_weight_type == "GEO":
+        degrees = np.trunc(coords)
+        radians = np.radians(degrees + (coords - degrees) * 5 / 3).tolist()
+
+        def geo_cost(a, b):
+            lat_a, lng_a = radians[a]
+            lat_b, lng_b = radians[b]
+            q1, q2, q3 = math.cos(lng_a - lng_b), math.cos(lat_a - lat_b), math.cos(lat_a + lat_b)
+            cosine = min(max(0.5 * ((1 + q1) * q2 - (1 - q1) * q3), -1.0), 1.0)
+            return float(math.trunc(6378.388 * math.acos(cosine) + 1))
+        return geo_cost
+
+    points = coords.tolist()
+
+    def coordinates_cost(a, b):
+        (x_a, y_a), (x_b, y_b) = points[a], points[b]
+        dx, dy = x_b - x_a, y_b - y_a
+        square_distance = dx * dx + dy * dy
+        if edge_weight_type == "ATT":
+            value = math.sqrt(square_distance / 10)
+            distance = math.trunc(value + 0.5)
+            return float(distance + 1 if distance < value else distance)
+        return float(math.trunc(math.sqrt(square_distance) + 0.5))
+    return coordinates_cost
+
+def node_coordinates(file_path):
+    # Coordinate per disegnare i tour (NODE_COORD_SECTION, altrimenti DISPLAY_DATA_SECTION) e edge_weight_type,
+    # coordinate None se l'istanza non ne ha
+    problem = tsplib95.load(file_path)
+    coords = problem.node_coords or problem.display_data
+    if not coords:
+        return None, problem.edge_weight_type
+    return np.array([coords[city] for city in problem.get_nodes()], dtype=float), problem.edge_weight_type
+
+def explicit_distance_matrix(edge_weights, edge_weight_format, num_cities):
+    weights = np.array([weight for row in edge_weights for weight in row], dtype=float)
+    if edge_weight_format == "FULL_MATRIX":
+        return weights.reshape(num_cities, num_cities)
+    # LOWER_DIAG_ROW: riempio il triangolo inferiore riga per riga e lo rifletto
+    distances = np.zeros((num_cities, num_cities))
+    distances[np.tril_indices(num_cities)] = weights
+    return distances + np.tril(distances, -1).T
+
+def read_tsp_instance(file_path, dense_max_cities=DENSE_MAX_CITIES):
+    # distances è la matrice n x n, oppure per le istanze con coordinate oltre dense_max_cities città
+    # un dizionario con coords, edge_weight_type e il grafo dei candidati (vedi edge_costs)
+    problem = tsplib95.load(file_path)
+    cities = list(problem.get_nodes())
+    num_cities = len(cities)
+    if problem.edge_weight_type in ("EUC_2D", "ATT", "GEO"):
+        coords = np.array([problem.node_coords[city] for city in cities], dtype=float)
+        if num_cities > dense_max_cities:
+            return cities, {'coords': coords, 'edge_weight_type': problem.edge_weight_type,
+                            'neighbors': candidate_graph(coords, problem.edge_weight_type, CANDIDATE_GRAPH_SIZE)}
+        distances = coordinates_distance_matrix(coords, problem.edge_weight_type)
+    elif problem.edge_weight_type == "EXPLICIT" and problem.edge_weight_format in ("FULL_MATRIX", "LOWER_DIAG_ROW"):
+        distances = explicit_distance_matrix(problem.edge_weights, problem.edge_weight_format, num_cities)
+    else:
+        # Altri formati: ricado su tsplib95, una chiamata per coppia
+        distances = np.array([[problem.get_weight(i, j) for j in cities] for i in cities], dtype=float)
+    # La matrice è indicizzata da 0 nell'ordine di cities
+    np.fill_diagonal(distances, 0)
+    return cities, distances
+
+def city_indices(solution, cities):
+    # Converto le etichette delle città negli indici della matrice delle distanze
+    index = {city: k for k, city in enumerate(cities)}
+    return np.array([index[city] for city in solution])
+
+def tsp_fitness(solution, distances):
+    # solution contiene indici della matrice, un tour (n,) o un blocco di tour (k, n)
+    solution = np.asarray(solution)
+    # Con np.roll aggiungo l'arco dall'ultima alla prima città
+    total_distance = edge_costs(distances, solution, np.roll(solution, -1, axis=-1)).sum(axis=-1)
+    return total_distance
+
+# Cache su disco delle istanze già compilate: matrice delle distanze (o coordinate e grafo dei candidati) in .npy
+# aperti in mmap, così i processi del pool condividono la stessa copia in page cache, e metadati in .npz
+CACHE_DIR = os.environ.get("PSO_TSP_CACHE", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".tsp_cache"))
+CACHE_VERSION = b"2"
+
+def instance_hash(file_path):
+    # La chiave dipende dal contenuto del .tsp e del .opt.tour (e dalla soglia delle istanze grandi), se un file cambia la voce diventa obsoleta
+    digest = hashlib.sha256(CACHE_VERSION + str(DENSE_MAX_CITIES).encode())
+    with open(file_path, "rb") as tsp_file:
+        digest.update(tsp_file.read())
+    solution_file_path = file_path[:-3] + "opt.tour"
+    if os.path.exists(solution_file_path):
+        with open(solution_file_path, "rb") as tour_file:
+            digest.update(tour_file.read())
+    return digest.hexdigest()[:16]
+
+def save_atomic(path, save, data):
+    # Scrivo su un file temporaneo e lo rinomino, i worker concorrenti non vedono mai file parziali
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            save(tmp_file, data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def compile_instance(file_path, entry_path):
+    cities, distances = read_tsp_instance(file_path)
+    if os.path.exists(file_path[:-3] + "opt.tour"):
+        optimal_solution = get_optimal_path(file_path)
+        optimal_cost = tsp_fitness(city_indices(optimal_solution, cities), distances).item()
+    else:
+        optimal_solution, optimal_cost = [], np.nan
+    if is_coordinate_backed(distances):
+        save_atomic(entry_path + ".coords.npy", np.save, distances['coords'])
+        save_atomic(entry_path + ".neighbors.npy", np.save, distances['neighbors'])
+        edge_weight_type = distances['edge_weight_type']
+    else:
+        save_atomic(entry_path + ".distances.npy", np.save, distances)
+        edge_weight_type = ""
+    # I metadati sono scritti per ultimi: se esistono la voce è completa
+    save_atomic(entry_path + ".meta.npz", lambda f, d: np.savez(f, **d), {"cities": np.array(cities), "optimal_solution": np.array(optimal_solution, dtype=int),
+                                                                         "optimal_cost": np.array(optimal_cost), "edge_weight_type": np.array(edge_weight_type)})
+
+def remove_stale_entries(stem, key, cache_dir):
+    for name in os.listdir(cache_dir):
+        if name.startswith(stem + "-") and not name.startswith(f"{stem}-{key}."):
+            try:
+                os.remove(os.path.join(cache_dir, name))
+            except FileNotFoundError:
+                pass
+
+def load_instance(file_path, cache_dir=CACHE_DIR):
+    # Restituisce cities, distances (sola lettura, in mmap), optimal_solution e optimal_cost (None se manca il .opt.tour).
+    # Per le istanze grandi distances è la versione con coordinate di read_tsp_instance
+    file_path = str(file_path)
+    stem = os.path.basename(file_path)[:-4]
+    key = instance_hash(file_path)
+    entry_path = os.path.join(cache_dir, f"{stem}-{key}")
+    if not os.path.exists(entry_path + ".meta.npz"):
+        os.makedirs(cache_dir, exist_ok=True)
+        remove_stale_entries(stem, key, cache_dir)
+        compile_instance(file_path, entry_path)
+
+    with np.load(entry_path + ".meta.npz") as meta:
+        cities = meta["cities"].tolist()
+        optimal_cost = meta["optimal_cost"].item()
+        edge_weight_type = meta["edge_weight_type"].item()
+        optimal_solution = meta["optimal_solution"].tolist()
+    if edge_weight_type:
+        distances = {'coords': np.load(entry_path + ".coords.npy", mmap_mode="r"),
+                     'edge_weight_type': edge_weight_type,
+                     'neighbors': np.load(entry_path + ".neighbors.npy", mmap_mode="r")}
+    else:
+        distances = np.load(entry_path + ".distances.npy", mmap_mode="r")
+    if np.isnan(optimal_cost):
+        return cities, distances, None, None
+    return cities, distances, optimal_solution, optimal_cost